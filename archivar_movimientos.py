@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Script para mover los movimientos viejos de stock_movimientos a archivos comprimidos por mes
+(STOCK_ARCHIVO_DIR, por defecto ./archivo_movimientos). /stock/movimientos/filtro/ los sigue
+devolviendo cuando el rango de fechas llega a los meses archivados.
+
+    python archivar_movimientos.py                       # anteriores al mismo mes del año pasado
+    python archivar_movimientos.py --antes-de 2024-01-01
+    python archivar_movimientos.py --reconstruir-registros  # egresos y pares por mes desde los archivos
+"""
+
+import argparse
+from datetime import datetime
+from database import SessionLocal
+from servicios.archivo_movimientos import archivar_movimientos, reconstruir_registros_archivo, FILAS_POR_LOTE
+
+def corte_por_defecto() -> datetime:
+    """Primer día del mes actual, un año atrás: siempre se archivan meses completos"""
+    hoy = datetime.utcnow()
+    return datetime(hoy.year - 1, hoy.month, 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archiva movimientos de stock viejos")
+    parser.add_argument("--antes-de", type=datetime.fromisoformat, default=None,
+                        help="Archivar movimientos anteriores a esta fecha (AAAA-MM-DD)")
+    parser.add_argument("--lote", type=int, default=FILAS_POR_LOTE, help="Movimientos por transacción")
+    parser.add_argument("--reconstruir-registros", action="store_true",
+                        help="Recargar los egresos y los pares por mes de lo ya archivado y salir")
+    args = parser.parse_args()
+
+    corte = args.antes_de or corte_por_defecto()
+    db = SessionLocal()
+    try:
+        if args.reconstruir_registros:
+            leidos = reconstruir_registros_archivo(db)
+            db.commit()
+            print(f"✅ Registros del archivo reconstruidos ({leidos} movimientos leídos)")
+        else:
+            print(f"🗄️ Archivando movimientos anteriores a {corte.date().isoformat()}...")
+            total = archivar_movimientos(db, corte, args.lote)
+            print(f"✅ Movimientos archivados: {total}")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error archivando movimientos: {e}")
+        raise
+    finally:
+        db.close()
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, literal, select
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
@@ -27,3 +27,38 @@ def get_db():
         yield db
     finally:
         db.close()
+
+def indices_faltantes(inspector) -> dict:
+    """{tabla: [índices del modelo que no existen en la base]}"""
+    faltantes = {}
+    for tabla in Base.metadata.sorted_tables:
+        if not tabla.indexes or not inspector.has_table(tabla.name):
+            continue
+        existentes = {indice["name"] for indice in inspector.get_indexes(tabla.name)}
+        pendientes = [indice for indice in tabla.indexes if indice.name not in existentes]
+        if pendientes:
+            faltantes[tabla] = pendientes
+    return faltantes
+
+def crear_indices_faltantes():
+    """create_all no agrega índices a tablas existentes. Al arrancar solo se crean los de tablas
+    vacías (no bloquean nada); en tablas con datos un CREATE INDEX común frena las escrituras
+    mientras dura, así que quedan para migrar_indices.py (CONCURRENTLY)"""
+    for tabla, indices in indices_faltantes(inspect(engine)).items():
+        with engine.connect() as conn:
+            if conn.execute(select(literal(1)).select_from(tabla).limit(1)).first() is not None:
+                continue
+        for indice in indices:
+            try:
+                indice.create(bind=engine, checkfirst=True)
+            except Exception as e:
+                # Otro proceso pudo crearlo al mismo tiempo
+                print(f"⚠️ No se pudo crear el índice {indice.name}: {e}")
+
+def verificar_indices() -> list:
+    """Devuelve (y avisa) los índices del modelo que no existen en la base"""
+    faltantes = [indice.name for indices in indices_faltantes(inspect(engine)).values() for indice in indices]
+    for nombre in faltantes:
+        print(f"⚠️ Falta el índice {nombre}: las consultas que lo usan recorren la tabla completa "
+              f"(crearlo con python migrar_indices.py)")
+    return faltantes
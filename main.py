@@ -1,18 +1,27 @@
 from fastapi import FastAPI
 from routers import stock, marcas, tipo_producto, proveedores, producto_lineas, procedencias, estados, depositos, productos, rubros, stock_movimientos, stock_sync, horas_extras, partes_trabajo
-from database import engine
+from database import engine, crear_indices_faltantes, verificar_indices
 from models import Base
 from fastapi.middleware.cors import CORSMiddleware
 from database import get_db
 from sqlalchemy.orm import Session
 from fastapi import Depends
 from models import Producto
+from servicios.particiones_movimientos import CreadorParticiones
+from servicios.snapshots_stock import SnapshotsAutomaticos
 import atexit
 
 app = FastAPI(title="Microservicio de Stock")
 
+# Crea por adelantado las particiones mensuales de stock_movimientos (solo PostgreSQL particionado)
+creador_particiones = CreadorParticiones(engine)
+# Snapshot nocturno de existencias para GET /api/stock/historico
+snapshots_automaticos = SnapshotsAutomaticos()
+
 # Crear todas las tablas automáticamente al iniciar
 Base.metadata.create_all(bind=engine)
+crear_indices_faltantes()
+verificar_indices()
 
 app.include_router(stock.router, prefix="/api")
 app.include_router(marcas.router, prefix="/api")
@@ -42,6 +51,8 @@ app.add_middleware(
 async def startup_event():
     """Eventos que se ejecutan al iniciar el servidor"""
     print("🚀 Servidor iniciado - Sincronizador desactivado temporalmente")
+    creador_particiones.iniciar()
+    snapshots_automaticos.iniciar()
     # try:
     #     from servicios.sincronizador_automatico import iniciar_sincronizacion_automatica
     #     iniciar_sincronizacion_automatica()
@@ -54,6 +65,8 @@ async def startup_event():
 async def shutdown_event():
     """Eventos que se ejecutan al cerrar el servidor"""
     print("⏹️ Servidor detenido")
+    creador_particiones.detener()
+    snapshots_automaticos.detener()
     # try:
     #     from servicios.sincronizador_automatico import detener_sincronizacion_automatica
     #     detener_sincronizacion_automatica()
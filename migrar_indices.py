@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+Script para crear los índices del modelo que falten en una base existente.
+En PostgreSQL usa CREATE INDEX CONCURRENTLY para no bloquear escrituras sobre
+tablas grandes como stock_movimientos. El arranque del servidor solo crea los de
+tablas vacías y avisa de los que falten: hay que correrlo antes de desplegar.
+"""
+
+from sqlalchemy import inspect
+from sqlalchemy.schema import CreateIndex
+from database import engine, verificar_indices, indices_faltantes
+from models import Base
+
+def crear_indice(indice):
+    """Crea un índice; en PostgreSQL sin bloquear la tabla si es posible"""
+    if engine.dialect.name != "postgresql":
+        indice.create(bind=engine)
+        return
+    sql = str(CreateIndex(indice).compile(dialect=engine.dialect))
+    concurrente = sql.replace(" INDEX ", " INDEX CONCURRENTLY ", 1)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        try:
+            conn.exec_driver_sql(concurrente)
+        except Exception as e:
+            # Las tablas particionadas no admiten CONCURRENTLY
+            print(f"⚠️ {indice.name}: no se pudo crear en forma concurrente ({e}), se crea en forma normal")
+            conn.exec_driver_sql(f"DROP INDEX IF EXISTS {indice.name}")
+            conn.exec_driver_sql(sql)
+
+def migrar_indices():
+    print("🔍 Buscando índices faltantes...")
+    creados = 0
+    for tabla, indices in indices_faltantes(inspect(engine)).items():
+        for indice in indices:
+            print(f"🔨 Creando {indice.name} en {tabla.name}...")
+            try:
+                crear_indice(indice)
+                creados += 1
+                print(f"✅ {indice.name} creado")
+            except Exception as e:
+                print(f"❌ Error creando {indice.name}: {e}")
+    print(f"📊 Índices creados: {creados}")
+    if not verificar_indices():
+        print("✅ Todos los índices del modelo existen")
+
+if __name__ == "__main__":
+    migrar_indices()
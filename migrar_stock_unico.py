@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Script para unificar filas duplicadas de stock por (producto_id, deposito_id)
+y crear el índice único que usan los movimientos (ux_stock_producto_deposito)
+"""
+
+from sqlalchemy import func
+from database import SessionLocal
+from migrar_indices import migrar_indices
+from models import Stock
+
+def unificar_stock_duplicado():
+    """Deja una sola fila por producto y depósito sumando las existencias"""
+    db = SessionLocal()
+    try:
+        duplicados = db.query(
+            Stock.producto_id,
+            Stock.deposito_id,
+            func.min(Stock.id).label("id"),
+            func.sum(Stock.existencia).label("existencia"),
+            func.max(Stock.stock_minimo).label("stock_minimo")
+        ).group_by(Stock.producto_id, Stock.deposito_id).having(func.count(Stock.id) > 1).all()
+        print(f"🔍 Combinaciones producto/depósito duplicadas: {len(duplicados)}")
+
+        for dup in duplicados:
+            db.query(Stock).filter(Stock.id == dup.id).update(
+                {"existencia": dup.existencia, "stock_minimo": dup.stock_minimo},
+                synchronize_session=False
+            )
+            eliminadas = db.query(Stock).filter(
+                Stock.producto_id == dup.producto_id,
+                Stock.deposito_id == dup.deposito_id,
+                Stock.id != dup.id
+            ).delete(synchronize_session=False)
+            print(f"   ✅ Producto {dup.producto_id} / depósito {dup.deposito_id}: "
+                  f"{eliminadas} filas unificadas en {dup.id} (existencia {dup.existencia})")
+
+        db.commit()
+    except Exception as e:
+        print(f"❌ Error unificando stock: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+    print("🔄 Creando índices faltantes...")
+    migrar_indices()
+    print("✅ Índice único de stock listo")
+
+if __name__ == "__main__":
+    unificar_stock_duplicado()
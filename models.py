@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, Text, Time, Table
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, Date, Text, Time, Table, Index
 from sqlalchemy.orm import relationship
 from database import Base
 import enum
@@ -79,6 +79,19 @@ class Stock(Base):
     producto = relationship("Producto")
     deposito = relationship("Deposito")
 
+# Una sola fila por producto y depósito; también es el índice de la búsqueda de cada movimiento
+Index("ux_stock_producto_deposito", Stock.producto_id, Stock.deposito_id, unique=True)
+
+# Índice parcial con las filas bajo el mínimo: lo mantiene la base en la misma transacción
+# que cada escritura de stock, así las alertas no recorren toda la tabla
+Index(
+    "ix_stock_bajo_minimo",
+    Stock.producto_id,
+    Stock.deposito_id,
+    postgresql_where=Stock.existencia < Stock.stock_minimo,
+    sqlite_where=Stock.existencia < Stock.stock_minimo,
+)
+
 class MovimientoTipo(enum.Enum):
     ingreso = "ingreso"
     egreso = "egreso"
@@ -99,6 +112,123 @@ class StockMovimiento(Base):
     producto = relationship("Producto")
     deposito = relationship("Deposito")
 
+# Recorre el historial en orden (fecha desc, id desc) sin ordenar toda la tabla
+Index("ix_stock_movimientos_fecha_id", StockMovimiento.fecha, StockMovimiento.id)
+# Búsqueda de egreso ya registrado por parte en sync_ordenes (producto_id, motivo, tipo)
+Index(
+    "ix_stock_movimientos_producto_motivo_tipo",
+    StockMovimiento.producto_id,
+    StockMovimiento.motivo,
+    StockMovimiento.tipo,
+)
+# /filtro/ por producto o depósito con rango de fechas, en el mismo orden que el cursor
+Index("ix_stock_movimientos_producto_fecha", StockMovimiento.producto_id, StockMovimiento.fecha, StockMovimiento.id)
+Index("ix_stock_movimientos_deposito_fecha", StockMovimiento.deposito_id, StockMovimiento.fecha, StockMovimiento.id)
+
+class StockMovimientoCorreccion(Base):
+    """Ajuste registrado por la corrección de consistencia (servicios/consistencia_stock.py).
+    No es un cambio de stock: el rollup diario lo deja afuera, y como guarda la existencia del
+    par al corregir funciona como un snapshot de ese par para /stock/historico"""
+    __tablename__ = "stock_movimientos_correcciones"
+    movimiento_id = Column(Integer, primary_key=True)
+    producto_id = Column(Integer, ForeignKey("productos.id"), nullable=False)
+    deposito_id = Column(Integer, ForeignKey("depositos.id"), nullable=False)
+    fecha = Column(DateTime, nullable=False)
+    existencia = Column(Float, nullable=False)
+
+Index("ix_stock_movimientos_correcciones_producto_deposito", StockMovimientoCorreccion.producto_id,
+      StockMovimientoCorreccion.deposito_id, StockMovimientoCorreccion.movimiento_id)
+
+class StockMovimientoDiario(Base):
+    """Totales diarios de movimientos por producto y depósito, mantenidos en la misma
+    transacción que cada movimiento"""
+    __tablename__ = "stock_movimientos_diarios"
+    producto_id = Column(Integer, ForeignKey("productos.id"), primary_key=True)
+    deposito_id = Column(Integer, ForeignKey("depositos.id"), primary_key=True)
+    dia = Column(Date, primary_key=True)
+    ingresos = Column(Float, nullable=False, default=0)
+    egresos = Column(Float, nullable=False, default=0)
+    ajustes = Column(Float, nullable=False, default=0)
+    movimientos = Column(Integer, nullable=False, default=0)
+
+Index("ix_stock_movimientos_diarios_dia_deposito", StockMovimientoDiario.dia, StockMovimientoDiario.deposito_id)
+
+class StockMovimientoArchivoMes(Base):
+    """Mes con movimientos movidos a archivos comprimidos (servicios/archivo_movimientos.py)"""
+    __tablename__ = "stock_movimientos_archivo_meses"
+    mes = Column(String(7), primary_key=True)  # AAAA-MM
+    filas = Column(Integer, nullable=False, default=0)
+    hasta = Column(DateTime, nullable=False)  # fecha del movimiento archivado más nuevo del mes
+    hasta_id = Column(Integer, nullable=True)  # id más alto archivado en el mes
+
+class StockMovimientoArchivoSaldo(Base):
+    """Suma con signo de los movimientos archivados por producto y depósito, para que el
+    control de consistencia y el kardex no tengan que leer los archivos"""
+    __tablename__ = "stock_movimientos_archivo_saldos"
+    producto_id = Column(Integer, ForeignKey("productos.id"), primary_key=True)
+    deposito_id = Column(Integer, ForeignKey("depositos.id"), primary_key=True)
+    cantidad = Column(Float, nullable=False, default=0)
+    movimientos = Column(Integer, nullable=False, default=0)
+
+class StockMovimientoArchivoPar(Base):
+    """Meses archivados que tienen movimientos de cada producto y depósito: las consultas
+    filtradas abren solo esos meses"""
+    __tablename__ = "stock_movimientos_archivo_pares"
+    mes = Column(String(7), primary_key=True)
+    producto_id = Column(Integer, ForeignKey("productos.id"), primary_key=True)
+    deposito_id = Column(Integer, ForeignKey("depositos.id"), primary_key=True)
+
+class StockMovimientoArchivoEgreso(Base):
+    """(producto, motivo) de cada egreso archivado: sync-ordenes lo sigue viendo como registrado"""
+    __tablename__ = "stock_movimientos_archivo_egresos"
+    producto_id = Column(Integer, ForeignKey("productos.id"), primary_key=True)
+    motivo = Column(String, primary_key=True)
+
+class StockSnapshot(Base):
+    """Foto periódica de la existencia por producto y depósito, base para reconstruir el pasado"""
+    __tablename__ = "stock_snapshots"
+    id = Column(Integer, primary_key=True)
+    fecha = Column(DateTime, nullable=False, index=True)
+    producto_id = Column(Integer, ForeignKey("productos.id"))
+    deposito_id = Column(Integer, ForeignKey("depositos.id"))
+    existencia = Column(Float, nullable=False)
+    # Id del último movimiento incluido en la foto: los posteriores son los que hay que sumar
+    movimiento_id = Column(Integer, nullable=True)
+
+Index("ix_stock_snapshots_producto_deposito_fecha", StockSnapshot.producto_id, StockSnapshot.deposito_id, StockSnapshot.fecha)
+
+class IdempotenciaMovimiento(Base):
+    """Respuesta ya emitida para un Idempotency-Key de las rutas de movimientos"""
+    __tablename__ = "idempotencia_movimientos"
+    clave = Column(String, primary_key=True)
+    hash_solicitud = Column(String, nullable=False)
+    movimiento_ids = Column(String, nullable=False)  # ids separados por coma
+    creado = Column(DateTime, default=datetime.utcnow, index=True)
+
+class SyncOrdenesEstado(Base):
+    """Marca de agua de /stock/sync-ordenes/: bookmark desde el que sigue la próxima corrida"""
+    __tablename__ = "sync_ordenes_estado"
+    id = Column(Integer, primary_key=True)  # una sola fila, id = 1
+    bookmark = Column(String, nullable=True)
+    actualizado = Column(DateTime, default=datetime.utcnow)
+    ultima_completa = Column(DateTime, nullable=True)  # última corrida desde la primera página
+
+class SyncOrdenesParte(Base):
+    """Parte ya procesado por sync-ordenes con la huella de su contenido; si la huella no
+    cambia no se vuelve a procesar"""
+    __tablename__ = "sync_ordenes_partes"
+    parte_id = Column(String, primary_key=True)
+    huella = Column(String, nullable=False)
+    procesado = Column(DateTime, default=datetime.utcnow)
+
+class SyncOrdenesPendiente(Base):
+    """Parte con líneas omitidas (producto desconocido o sin stock); se reintenta en cada corrida
+    desde el documento guardado, esté o no en las páginas que se vuelven a pedir"""
+    __tablename__ = "sync_ordenes_pendientes"
+    parte_id = Column(String, primary_key=True)
+    documento = Column(Text, nullable=False)  # JSON del parte tal como lo devolvió la API
+    desde = Column(DateTime, default=datetime.utcnow)
+
 # Nuevos modelos para sistema de horas extras
 class Tecnico(Base):
     __tablename__ = "tecnicos"
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+Script para convertir stock_movimientos en una tabla particionada por mes (PostgreSQL).
+Las consultas de /stock/movimientos/filtro/ con fecha_ini/fecha_fin solo leen los meses
+del rango y los meses viejos se pueden desacoplar sin borrar fila por fila.
+
+    python particionar_movimientos.py                     # convertir la tabla
+    python particionar_movimientos.py --desacoplar 2023-01  # separar un mes ya archivado (vacío)
+"""
+
+import argparse
+from database import engine
+from migrar_indices import migrar_indices
+from servicios.particiones_movimientos import convertir_a_particionada, desacoplar_particion
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Particionado mensual de stock_movimientos")
+    parser.add_argument("--desacoplar", metavar="AAAA-MM", help="Mes a desacoplar de la tabla")
+    parser.add_argument("--eliminar", action="store_true", help="Eliminar la partición desacoplada")
+    args = parser.parse_args()
+
+    if args.desacoplar:
+        anio, mes = (int(p) for p in args.desacoplar.split("-"))
+        try:
+            desacoplar_particion(engine, anio, mes, eliminar=args.eliminar)
+        except RuntimeError as e:
+            print(f"❌ {e}")
+            raise SystemExit(1)
+    else:
+        print("🔄 Convirtiendo stock_movimientos a tabla particionada...")
+        convertir_a_particionada(engine)
+        # Los índices del modelo se crean sobre la tabla madre y se propagan a cada partición
+        migrar_indices()
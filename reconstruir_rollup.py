@@ -0,0 +1,31 @@
+#!/usr/bin/env python3
+"""
+Script para reconstruir la tabla stock_movimientos_diarios a partir de stock_movimientos.
+
+    python reconstruir_rollup.py                                   # todo el historial
+    python reconstruir_rollup.py --desde 2025-01-01 --hasta 2025-03-31
+"""
+
+import argparse
+from datetime import date
+from database import SessionLocal
+from servicios.rollup_movimientos import reconstruir_rollup
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Reconstruye los totales diarios de movimientos")
+    parser.add_argument("--desde", type=date.fromisoformat, help="Primer día (AAAA-MM-DD)")
+    parser.add_argument("--hasta", type=date.fromisoformat, help="Último día (AAAA-MM-DD)")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        print("🔄 Reconstruyendo totales diarios de movimientos...")
+        filas = reconstruir_rollup(db, args.desde, args.hasta)
+        db.commit()
+        print(f"✅ Totales diarios reconstruidos: {filas} filas")
+    except Exception as e:
+        db.rollback()
+        print(f"❌ Error reconstruyendo totales diarios: {e}")
+        raise
+    finally:
+        db.close()
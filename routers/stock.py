@@ -1,8 +1,19 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Header, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
-from database import get_db
-from models import Stock, Producto, Deposito
+from sqlalchemy import text, tuple_, func, case
+from typing import List, Optional
+from database import get_db, SessionLocal
+from models import Stock, StockMovimiento, Producto, Deposito, Rubro, Marca, Proveedor
+from servicios.cache_stock import resumen_cache, existencias_cache, fila_stock, marcar_stock_modificado
+from servicios.snapshots_stock import tomar_snapshot, existencia_historica
+from servicios.operaciones_stock import cantidad_con_signo
+from servicios.consistencia_stock import verificar_consistencia, corregir_discrepancias
+from servicios.eventos_stock import canal_eventos
+from servicios.archivo_movimientos import saldos_archivados
+from datetime import datetime
+import asyncio
+import json
 import schemas
 
 router = APIRouter(
@@ -10,13 +21,435 @@ router = APIRouter(
     tags=["stock"]
 )
 
-@router.get("/", response_model=List[schemas.StockOut])
-def get_stock(db: Session = Depends(get_db)):
-    return db.query(Stock).all()
+def _filtrar_stock(query, deposito_id=None, producto_id=None, rubro_id=None, marca_id=None, bajo_minimo=False,
+                   con_producto=False):
+    """Aplica los filtros comunes de stock; solo hace join con Producto si se filtra por rubro o marca
+    y la consulta no lo incluye ya (con_producto)"""
+    if deposito_id is not None:
+        query = query.filter(Stock.deposito_id == deposito_id)
+    if producto_id is not None:
+        query = query.filter(Stock.producto_id == producto_id)
+    if rubro_id is not None or marca_id is not None:
+        if not con_producto:
+            query = query.join(Producto, Producto.id == Stock.producto_id)
+        if rubro_id is not None:
+            query = query.filter(Producto.rubro_id == rubro_id)
+        if marca_id is not None:
+            query = query.filter(Producto.marca_id == marca_id)
+    if bajo_minimo:
+        query = query.filter(Stock.existencia < Stock.stock_minimo)
+    return query
+
+def _total_aproximado(db: Session, query, con_filtros: bool) -> int:
+    """Sin filtros en PostgreSQL usa la estimación del planner; en otro caso cuenta las filas filtradas"""
+    if not con_filtros and db.bind.dialect.name == "postgresql":
+        estimado = db.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :tabla"),
+            {"tabla": Stock.__tablename__}
+        ).scalar()
+        # reltuples es -1 (o 0) mientras la tabla no fue analizada
+        if estimado and estimado > 0:
+            return estimado
+    return query.order_by(None).count()
+
+@router.get("/", response_model=schemas.StockPagina)
+def get_stock(
+    deposito_id: Optional[int] = Query(None, description="Filtrar por depósito"),
+    producto_id: Optional[int] = Query(None, description="Filtrar por producto"),
+    rubro_id: Optional[int] = Query(None, description="Filtrar por rubro del producto"),
+    marca_id: Optional[int] = Query(None, description="Filtrar por marca del producto"),
+    bajo_minimo: bool = Query(False, description="Solo filas con existencia menor al stock mínimo"),
+    cursor: Optional[int] = Query(None, description="next_cursor devuelto por la página anterior"),
+    limit: int = Query(200, ge=1, le=1000, description="Número máximo de registros a retornar"),
+    incluir_total: bool = Query(False, description="Incluir el total aproximado de filas que cumplen los filtros"),
+    db: Session = Depends(get_db)
+):
+    """Obtiene el stock paginado por id (keyset) con filtros opcionales"""
+    query = _filtrar_stock(db.query(Stock), deposito_id, producto_id, rubro_id, marca_id, bajo_minimo)
+    pagina = query
+    if cursor is not None:
+        pagina = pagina.filter(Stock.id > cursor)
+    # Se pide una fila extra para saber si hay una página siguiente
+    filas = pagina.order_by(Stock.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = filas[-1].id
+
+    total = None
+    if incluir_total:
+        con_filtros = any(f is not None for f in (deposito_id, producto_id, rubro_id, marca_id)) or bajo_minimo
+        total = _total_aproximado(db, query, con_filtros)
+
+    return {"items": filas, "next_cursor": next_cursor, "total_aproximado": total}
+
+@router.get("/vista", response_model=schemas.StockVistaPagina)
+def get_stock_vista(
+    deposito_id: Optional[int] = Query(None, description="Filtrar por depósito"),
+    producto_id: Optional[int] = Query(None, description="Filtrar por producto"),
+    rubro_id: Optional[int] = Query(None, description="Filtrar por rubro del producto"),
+    marca_id: Optional[int] = Query(None, description="Filtrar por marca del producto"),
+    bajo_minimo: bool = Query(False, description="Solo filas con existencia menor al stock mínimo"),
+    cursor: Optional[int] = Query(None, description="next_cursor devuelto por la página anterior"),
+    limit: int = Query(1000, ge=1, le=5000, description="Número máximo de registros a retornar"),
+    db: Session = Depends(get_db)
+):
+    """Stock con nombres de producto, depósito, rubro y marca en una sola consulta (sin hidratar objetos ORM)"""
+    query = db.query(
+        Stock.id,
+        Stock.producto_id,
+        Stock.deposito_id,
+        Stock.existencia,
+        Stock.stock_minimo,
+        Producto.codigo.label("producto_codigo"),
+        Producto.descripcion.label("producto_descripcion"),
+        Deposito.nombre.label("deposito_nombre"),
+        Rubro.nombre.label("rubro_nombre"),
+        Marca.nombre.label("marca_nombre"),
+    ).join(Producto, Producto.id == Stock.producto_id) \
+     .join(Deposito, Deposito.id == Stock.deposito_id) \
+     .outerjoin(Rubro, Rubro.id == Producto.rubro_id) \
+     .outerjoin(Marca, Marca.id == Producto.marca_id)
+    query = _filtrar_stock(query, deposito_id, producto_id, rubro_id, marca_id, bajo_minimo, con_producto=True)
+    if cursor is not None:
+        query = query.filter(Stock.id > cursor)
+    filas = query.order_by(Stock.id).limit(limit + 1).all()
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        next_cursor = filas[-1].id
+    return {"items": [dict(fila._mapping) for fila in filas], "next_cursor": next_cursor}
+
+# Dimensiones admitidas en /resumen: columna de agrupación, nombre y join necesario para el nombre
+DIMENSIONES_RESUMEN = {
+    "rubro": (Producto.rubro_id, Rubro.nombre, (Rubro, Rubro.id == Producto.rubro_id)),
+    "marca": (Producto.marca_id, Marca.nombre, (Marca, Marca.id == Producto.marca_id)),
+    "proveedor": (Producto.proveedor_id, Proveedor.nombre, (Proveedor, Proveedor.id == Producto.proveedor_id)),
+    "deposito": (Stock.deposito_id, Deposito.nombre, (Deposito, Deposito.id == Stock.deposito_id)),
+}
+
+@router.get("/resumen", response_model=List[schemas.StockResumenOut])
+def get_stock_resumen(
+    agrupar: str = Query("", description="Dimensiones separadas por coma: rubro, marca, proveedor, deposito"),
+    db: Session = Depends(get_db)
+):
+    """Totales de stock agrupados en SQL; se cachea unos segundos y se invalida con cada escritura de stock"""
+    dimensiones = [d.strip() for d in agrupar.split(",") if d.strip()]
+    invalidas = [d for d in dimensiones if d not in DIMENSIONES_RESUMEN]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Dimensiones inválidas: {', '.join(invalidas)}")
+    dimensiones = sorted(set(dimensiones), key=list(DIMENSIONES_RESUMEN).index)
+
+    clave = tuple(dimensiones)
+    resumen = resumen_cache.obtener(clave)
+    if resumen is not None:
+        return resumen
+
+    columnas = []
+    agrupacion = []
+    for dimension in dimensiones:
+        columna_id, columna_nombre, _ = DIMENSIONES_RESUMEN[dimension]
+        columnas += [columna_id.label(f"{dimension}_id"), columna_nombre.label(f"{dimension}_nombre")]
+        agrupacion += [columna_id, columna_nombre]
+    query = db.query(
+        *columnas,
+        func.count(Stock.id).label("filas"),
+        func.count(func.distinct(Stock.producto_id)).label("productos"),
+        func.coalesce(func.sum(Stock.existencia), 0).label("existencia_total"),
+        func.coalesce(func.sum(case((Stock.existencia < Stock.stock_minimo, 1), else_=0)), 0).label("bajo_minimo"),
+    ).select_from(Stock)
+    if any(d != "deposito" for d in dimensiones):
+        query = query.join(Producto, Producto.id == Stock.producto_id)
+    for dimension in dimensiones:
+        tabla, condicion = DIMENSIONES_RESUMEN[dimension][2]
+        query = query.outerjoin(tabla, condicion)
+    if agrupacion:
+        query = query.group_by(*agrupacion).order_by(*agrupacion)
+
+    resumen = [dict(fila._mapping) for fila in query.all()]
+    resumen_cache.guardar(clave, resumen)
+    return resumen
+
+@router.get("/historico", response_model=schemas.StockHistoricoOut)
+def get_stock_historico(
+    fecha: datetime = Query(..., description="Fecha y hora (UTC) a reconstruir"),
+    producto_id: Optional[int] = Query(None, description="Filtrar por producto"),
+    deposito_id: Optional[int] = Query(None, description="Filtrar por depósito"),
+    db: Session = Depends(get_db)
+):
+    """Existencia a una fecha pasada: snapshot anterior más cercano + movimientos desde entonces"""
+    return existencia_historica(db, fecha, producto_id, deposito_id)
+
+@router.post("/historico/snapshot")
+def crear_snapshot(db: Session = Depends(get_db)):
+    """Toma un snapshot de la existencia actual (además del automático nocturno)"""
+    fecha = tomar_snapshot(db)
+    db.commit()
+    return {"fecha": fecha}
+
+@router.get("/consistencia", response_model=schemas.StockConsistenciaOut)
+def get_consistencia(
+    producto_id: Optional[int] = Query(None, description="Revisar un solo producto"),
+    hilos: int = Query(4, ge=1, le=16, description="Bloques revisados en paralelo")
+):
+    """Compara la existencia de cada (producto, depósito) con la suma de sus movimientos"""
+    return verificar_consistencia(hilos=hilos, producto_id=producto_id)
+
+@router.post("/consistencia/corregir", response_model=schemas.StockConsistenciaOut)
+def corregir_consistencia(
+    producto_id: Optional[int] = Query(None, description="Corregir un solo producto"),
+    hilos: int = Query(4, ge=1, le=16, description="Bloques revisados en paralelo"),
+    db: Session = Depends(get_db)
+):
+    """Revisa y registra un ajuste por cada diferencia encontrada entre existencia y movimientos"""
+    resultado = verificar_consistencia(hilos=hilos, producto_id=producto_id)
+    resultado["corregidas"] = corregir_discrepancias(db, resultado["discrepancias"])
+    db.commit()
+    return resultado
+
+def _kardex_ndjson(producto_id: int, deposito_id: Optional[int]):
+    """Genera el kardex fila por fila con un cursor del lado del servidor; usa su propia sesión
+    porque la respuesta se sigue enviando después de que termina el endpoint"""
+    signo = cantidad_con_signo()
+    orden = (StockMovimiento.fecha, StockMovimiento.id)
+    db = SessionLocal()
+    try:
+        # Los saldos corridos arrancan desde lo ya archivado
+        archivado = {d: c for (_, d), c in saldos_archivados(db, producto_id=producto_id).items()
+                     if deposito_id is None or d == deposito_id}
+        archivado_total = sum(archivado.values())
+        consulta = db.query(
+            StockMovimiento.id,
+            StockMovimiento.fecha,
+            StockMovimiento.deposito_id,
+            StockMovimiento.tipo,
+            StockMovimiento.cantidad,
+            StockMovimiento.motivo,
+            func.sum(signo).over(partition_by=StockMovimiento.deposito_id, order_by=orden).label("saldo"),
+            func.sum(signo).over(order_by=orden).label("saldo_total"),
+        ).filter(StockMovimiento.producto_id == producto_id)
+        if deposito_id is not None:
+            consulta = consulta.filter(StockMovimiento.deposito_id == deposito_id)
+        filas = consulta.order_by(*orden).execution_options(stream_results=True, yield_per=1000)
+        for fila in filas:
+            yield json.dumps({
+                "id": fila.id,
+                "fecha": fila.fecha.isoformat() if fila.fecha else None,
+                "deposito_id": fila.deposito_id,
+                "tipo": fila.tipo.value,
+                "cantidad": fila.cantidad,
+                "motivo": fila.motivo,
+                "saldo": fila.saldo + archivado.get(fila.deposito_id, 0),
+                "saldo_total": fila.saldo_total + archivado_total,
+            }) + "\n"
+    finally:
+        db.close()
+
+@router.get("/kardex/{producto_id}")
+def get_kardex(
+    producto_id: int,
+    deposito_id: Optional[int] = Query(None, description="Limitar a un depósito"),
+    db: Session = Depends(get_db)
+):
+    """Kardex del producto en NDJSON: cada movimiento con el saldo corrido de su depósito (saldo)
+    y de todos los depósitos (saldo_total), calculados con funciones de ventana en SQL"""
+    if not db.get(Producto, producto_id):
+        raise HTTPException(status_code=404, detail="Producto no encontrado")
+    return StreamingResponse(_kardex_ndjson(producto_id, deposito_id), media_type="application/x-ndjson")
+
+@router.get("/alertas", response_model=List[schemas.StockAlertasProveedor])
+def get_alertas_stock(
+    deposito_id: Optional[int] = Query(None, description="Filtrar por depósito"),
+    proveedor_id: Optional[int] = Query(None, description="Filtrar por proveedor del producto"),
+    db: Session = Depends(get_db)
+):
+    """Filas con existencia menor al stock mínimo, agrupadas por proveedor.
+    El filtro coincide con el índice parcial ix_stock_bajo_minimo, así el costo depende
+    de la cantidad de alertas y no del tamaño del catálogo."""
+    query = db.query(
+        Stock.id,
+        Stock.producto_id,
+        Stock.deposito_id,
+        Stock.existencia,
+        Stock.stock_minimo,
+        Producto.codigo.label("producto_codigo"),
+        Producto.descripcion.label("producto_descripcion"),
+        Producto.proveedor_id,
+        Proveedor.nombre.label("proveedor_nombre"),
+        Deposito.nombre.label("deposito_nombre"),
+    ).filter(Stock.existencia < Stock.stock_minimo) \
+     .join(Producto, Producto.id == Stock.producto_id) \
+     .outerjoin(Proveedor, Proveedor.id == Producto.proveedor_id) \
+     .outerjoin(Deposito, Deposito.id == Stock.deposito_id)
+    if deposito_id is not None:
+        query = query.filter(Stock.deposito_id == deposito_id)
+    if proveedor_id is not None:
+        query = query.filter(Producto.proveedor_id == proveedor_id)
+
+    grupos = {}
+    for fila in query.order_by(Producto.proveedor_id, Stock.producto_id, Stock.deposito_id):
+        grupo = grupos.setdefault(fila.proveedor_id, {
+            "proveedor_id": fila.proveedor_id,
+            "proveedor_nombre": fila.proveedor_nombre,
+            "items": []
+        })
+        grupo["items"].append({
+            "id": fila.id,
+            "producto_id": fila.producto_id,
+            "deposito_id": fila.deposito_id,
+            "existencia": fila.existencia,
+            "stock_minimo": fila.stock_minimo,
+            "faltante": fila.stock_minimo - fila.existencia,
+            "producto_codigo": fila.producto_codigo,
+            "producto_descripcion": fila.producto_descripcion,
+            "deposito_nombre": fila.deposito_nombre,
+        })
+    return list(grupos.values())
+
+# Sin eventos durante este tiempo se manda un latido, que además detecta clientes desconectados
+INTERVALO_LATIDO = 15
+
+@router.get("/eventos")
+async def stream_eventos(
+    request: Request,
+    deposito_id: Optional[List[int]] = Query(None, description="Solo estos depósitos"),
+    producto_id: Optional[List[int]] = Query(None, description="Solo estos productos")
+):
+    """Server-Sent Events con cada cambio de stock confirmado. Un evento "resync" indica que
+    se perdieron eventos (cliente lento) y hay que volver a leer GET /api/stock"""
+    suscripcion = canal_eventos.suscribir(deposito_id, producto_id)
+
+    async def generar():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    evento = await asyncio.wait_for(suscripcion.cola.get(), INTERVALO_LATIDO)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: {evento['tipo']}\ndata: {json.dumps(evento)}\n\n"
+        finally:
+            canal_eventos.desuscribir(suscripcion)
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.websocket("/eventos/ws")
+async def websocket_eventos(
+    websocket: WebSocket,
+    deposito_id: Optional[List[int]] = Query(None),
+    producto_id: Optional[List[int]] = Query(None)
+):
+    """Mismos eventos que /eventos, como mensajes JSON por WebSocket"""
+    await websocket.accept()
+    suscripcion = canal_eventos.suscribir(deposito_id, producto_id)
+    try:
+        while True:
+            try:
+                evento = await asyncio.wait_for(suscripcion.cola.get(), INTERVALO_LATIDO)
+            except asyncio.TimeoutError:
+                evento = {"tipo": "ping"}
+            await websocket.send_json(evento)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        canal_eventos.desuscribir(suscripcion)
 
 @router.get("/{producto_id}", response_model=List[schemas.StockOut])
-def get_stock_producto(producto_id: int, db: Session = Depends(get_db)):
-    return db.query(Stock).filter(Stock.producto_id == producto_id).all()
+def get_stock_producto(
+    producto_id: int,
+    deposito_id: Optional[int] = Query(None, description="Limitar a un depósito"),
+    cache_control: Optional[str] = Header(None, description="no-cache para leer directo de la base"),
+    db: Session = Depends(get_db)
+):
+    """Stock de un producto; se responde desde la cache de existencias salvo Cache-Control: no-cache"""
+    usar_cache = not (cache_control and "no-cache" in cache_control.lower())
+    if usar_cache:
+        if deposito_id is not None:
+            fila = existencias_cache.obtener(producto_id, deposito_id)
+            if fila is not None:
+                return [fila]
+        else:
+            filas = existencias_cache.obtener_producto(producto_id)
+            if filas is not None:
+                return filas
+
+    version = existencias_cache.version()
+    query = db.query(Stock).filter(Stock.producto_id == producto_id)
+    if deposito_id is not None:
+        query = query.filter(Stock.deposito_id == deposito_id)
+    stocks = query.all()
+    if deposito_id is None:
+        existencias_cache.cargar_producto(producto_id, [fila_stock(s) for s in stocks], version)
+    else:
+        for s in stocks:
+            existencias_cache.cargar(fila_stock(s), version)
+    return stocks
+
+@router.put("/lote", response_model=List[schemas.StockLoteResultado])
+def update_stock_lote(items: List[schemas.StockLoteItem], db: Session = Depends(get_db)):
+    """Aplica muchas actualizaciones de existencia/stock_minimo en una sola transacción"""
+    resultados = []
+    validos = []
+    for indice, item in enumerate(items):
+        cambios = item.dict(include={"existencia", "stock_minimo"}, exclude_none=True)
+        resultado = {"indice": indice, "stock_id": item.stock_id, "estado": "invalido", "detalle": None}
+        resultados.append(resultado)
+        if item.stock_id is None and (item.producto_id is None or item.deposito_id is None):
+            resultado["detalle"] = "Se requiere stock_id o producto_id y deposito_id"
+        elif not cambios:
+            resultado["detalle"] = "Sin campos para actualizar"
+        else:
+            validos.append((resultado, item, cambios))
+
+    # Resolver ids con una consulta por tipo de clave en lugar de una por fila
+    ids = {item.stock_id for _, item, _ in validos if item.stock_id is not None}
+    pares = {(item.producto_id, item.deposito_id) for _, item, _ in validos if item.stock_id is None}
+    claves_por_id = {}
+    if ids:
+        claves_por_id = {
+            fila.id: (fila.producto_id, fila.deposito_id)
+            for fila in db.query(Stock.id, Stock.producto_id, Stock.deposito_id).filter(Stock.id.in_(ids))
+        }
+    ids_por_par = {}
+    if pares:
+        ids_por_par = {
+            (fila.producto_id, fila.deposito_id): fila.id
+            for fila in db.query(Stock.id, Stock.producto_id, Stock.deposito_id)
+            .filter(tuple_(Stock.producto_id, Stock.deposito_id).in_(pares))
+        }
+        claves_por_id.update({stock_id: par for par, stock_id in ids_por_par.items()})
+
+    # Si un mismo stock aparece varias veces, los cambios posteriores pisan a los anteriores
+    cambios_por_id = {}
+    for resultado, item, cambios in validos:
+        if item.stock_id is not None:
+            stock_id = item.stock_id if item.stock_id in claves_por_id else None
+        else:
+            stock_id = ids_por_par.get((item.producto_id, item.deposito_id))
+        if stock_id is None:
+            resultado["estado"] = "no_encontrado"
+            resultado["detalle"] = "Stock no encontrado"
+            continue
+        resultado["stock_id"] = stock_id
+        resultado["estado"] = "actualizado"
+        cambios_por_id.setdefault(stock_id, {"id": stock_id}).update(cambios)
+
+    if cambios_por_id:
+        # executemany agrupado por conjunto de columnas
+        db.bulk_update_mappings(Stock, list(cambios_por_id.values()))
+        marcar_stock_modificado(db, [
+            dict(cambios, producto_id=claves_por_id[stock_id][0], deposito_id=claves_por_id[stock_id][1])
+            for stock_id, cambios in cambios_por_id.items()
+        ])
+        db.commit()
+    return resultados
 
 @router.put("/{stock_id}", response_model=schemas.StockOut)
 def update_stock(stock_id: int, stock: schemas.StockUpdate, db: Session = Depends(get_db)):
@@ -1,9 +1,17 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File, Header
 from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import tuple_, func
+from typing import List, Optional
 from database import get_db
-from models import StockMovimiento, Stock, Producto, Deposito
-from datetime import datetime
+from models import StockMovimiento, StockMovimientoDiario, Stock, Producto, Deposito
+from servicios.cache_stock import marcar_stock_modificado
+from servicios.operaciones_stock import sumar_existencia, descontar_existencia, bloquear_filas_stock
+from servicios.idempotencia import ejecutar_idempotente
+from servicios.rollup_movimientos import acumular_en_rollup
+from servicios.archivo_movimientos import completar_con_archivo
+from datetime import datetime, date
+import csv
+import io
 import schemas
 
 router = APIRouter(
@@ -11,18 +19,53 @@ router = APIRouter(
     tags=["stock_movimientos"]
 )
 
-@router.get("/", response_model=List[schemas.StockMovimientoOut])
-def get_movimientos(db: Session = Depends(get_db)):
-    return db.query(StockMovimiento).order_by(StockMovimiento.fecha.desc()).all()
+def _leer_cursor(cursor: str):
+    """El cursor es "<fecha ISO>|<id>" del último movimiento de la página anterior
+    ("|<id>" si ese movimiento no tiene fecha)"""
+    try:
+        fecha, movimiento_id = cursor.rsplit("|", 1)
+        return (datetime.fromisoformat(fecha) if fecha else None), int(movimiento_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
-@router.post("/ingreso/", response_model=schemas.StockMovimientoOut)
-def ingreso_stock(mov: schemas.StockMovimientoCreate, db: Session = Depends(get_db)):
-    # Sumar existencia en stock, crear si no existe
-    stock = db.query(Stock).filter(Stock.producto_id == mov.producto_id, Stock.deposito_id == mov.deposito_id).first()
-    if not stock:
-        stock = Stock(producto_id=mov.producto_id, deposito_id=mov.deposito_id, existencia=0, stock_minimo=0)
-        db.add(stock)
-    stock.existencia += mov.cantidad
+def _paginar_movimientos(query, cursor: Optional[str], limit: int, archivo: Optional[dict] = None) -> dict:
+    """Keyset por (fecha, id) descendente: cada página es un rango del índice, sin OFFSET ni sort total.
+    Con `archivo` (filtros de la consulta) la página se completa con los movimientos archivados.
+    Los movimientos sin fecha van al final, por id descendente."""
+    posicion = None
+    if cursor:
+        posicion = _leer_cursor(cursor)
+    filas = []
+    if posicion is None or posicion[0] is not None:
+        con_fecha = query.filter(StockMovimiento.fecha.isnot(None))
+        if posicion:
+            con_fecha = con_fecha.filter(tuple_(StockMovimiento.fecha, StockMovimiento.id) < tuple_(*posicion))
+        filas = con_fecha.order_by(StockMovimiento.fecha.desc(), StockMovimiento.id.desc()).limit(limit + 1).all()
+        if archivo is not None:
+            filas = completar_con_archivo(query.session, filas, limit + 1, posicion, **archivo)
+    if len(filas) <= limit:
+        sin_fecha = query.filter(StockMovimiento.fecha.is_(None))
+        if posicion and posicion[0] is None:
+            sin_fecha = sin_fecha.filter(StockMovimiento.id < posicion[1])
+        filas += sin_fecha.order_by(StockMovimiento.id.desc()).limit(limit + 1 - len(filas)).all()
+    next_cursor = None
+    if len(filas) > limit:
+        filas = filas[:limit]
+        ultima = filas[-1]
+        next_cursor = f"{ultima.fecha.isoformat() if ultima.fecha else ''}|{ultima.id}"
+    return {"items": filas, "next_cursor": next_cursor}
+
+@router.get("/", response_model=schemas.StockMovimientoPagina)
+def get_movimientos(
+    cursor: Optional[str] = Query(None, description="next_cursor devuelto por la página anterior"),
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a retornar"),
+    db: Session = Depends(get_db)
+):
+    return _paginar_movimientos(db.query(StockMovimiento), cursor, limit)
+
+def _registrar_ingreso(db: Session, mov: schemas.StockMovimientoCreate) -> List[StockMovimiento]:
+    # Sumar existencia en stock, crear si no existe (upsert en una sola sentencia)
+    sumar_existencia(db, mov.producto_id, mov.deposito_id, mov.cantidad)
     movimiento = StockMovimiento(
         producto_id=mov.producto_id,
         deposito_id=mov.deposito_id,
@@ -31,16 +74,11 @@ def ingreso_stock(mov: schemas.StockMovimientoCreate, db: Session = Depends(get_
         motivo=mov.motivo
     )
     db.add(movimiento)
-    db.commit()
-    db.refresh(movimiento)
-    return movimiento
+    return [movimiento]
 
-@router.post("/egreso/", response_model=schemas.StockMovimientoOut)
-def egreso_stock(mov: schemas.StockMovimientoCreate, db: Session = Depends(get_db)):
-    stock = db.query(Stock).filter(Stock.producto_id == mov.producto_id, Stock.deposito_id == mov.deposito_id).first()
-    if not stock or stock.existencia < mov.cantidad:
+def _registrar_egreso(db: Session, mov: schemas.StockMovimientoCreate) -> List[StockMovimiento]:
+    if not descontar_existencia(db, mov.producto_id, mov.deposito_id, mov.cantidad):
         raise HTTPException(status_code=400, detail="Stock insuficiente")
-    stock.existencia -= mov.cantidad
     movimiento = StockMovimiento(
         producto_id=mov.producto_id,
         deposito_id=mov.deposito_id,
@@ -49,16 +87,133 @@ def egreso_stock(mov: schemas.StockMovimientoCreate, db: Session = Depends(get_d
         motivo=mov.motivo
     )
     db.add(movimiento)
-    db.commit()
-    db.refresh(movimiento)
-    return movimiento
+    return [movimiento]
+
+def _registrar_ajuste(db: Session, mov: schemas.StockMovimientoCreate) -> List[StockMovimiento]:
+    sumar_existencia(db, mov.producto_id, mov.deposito_id, mov.cantidad)
+    movimiento = StockMovimiento(
+        producto_id=mov.producto_id,
+        deposito_id=mov.deposito_id,
+        cantidad=mov.cantidad,
+        tipo=schemas.MovimientoTipo.ajuste,
+        motivo=mov.motivo
+    )
+    db.add(movimiento)
+    return [movimiento]
+
+def _registrar_lote(db: Session, movs: List[schemas.StockMovimientoCreate]) -> List[StockMovimiento]:
+    pares = {(m.producto_id, m.deposito_id) for m in movs}
+    crear = {(m.producto_id, m.deposito_id) for m in movs if m.tipo != schemas.MovimientoTipo.egreso}
+    stocks = bloquear_filas_stock(db, pares, crear)
+
+    movimientos = []
+    for indice, mov in enumerate(movs):
+        stock = stocks.get((mov.producto_id, mov.deposito_id))
+        if mov.tipo == schemas.MovimientoTipo.egreso:
+            if not stock or stock.existencia < mov.cantidad:
+                db.rollback()
+                raise HTTPException(status_code=400, detail=f"Línea {indice}: Stock insuficiente")
+            stock.existencia -= mov.cantidad
+        else:
+            stock.existencia += mov.cantidad
+        movimientos.append(StockMovimiento(
+            producto_id=mov.producto_id,
+            deposito_id=mov.deposito_id,
+            cantidad=mov.cantidad,
+            tipo=mov.tipo,
+            motivo=mov.motivo,
+            cliente_id=mov.cliente_id,
+            cliente_empresa=mov.cliente_empresa
+        ))
+    db.add_all(movimientos)
+    return movimientos
+
+def _registrar_transferencia(db: Session, t: schemas.StockTransferenciaCreate) -> List[StockMovimiento]:
+    if t.deposito_origen_id == t.deposito_destino_id:
+        raise HTTPException(status_code=400, detail="El depósito de origen y destino deben ser distintos")
+    if t.cantidad <= 0:
+        raise HTTPException(status_code=400, detail="La cantidad debe ser mayor a cero")
+    origen = (t.producto_id, t.deposito_origen_id)
+    destino = (t.producto_id, t.deposito_destino_id)
+    # Las dos filas se bloquean en orden de id, así transferencias cruzadas no se bloquean mutuamente
+    stocks = bloquear_filas_stock(db, {origen, destino}, {destino})
+    stock_origen = stocks.get(origen)
+    if not stock_origen or (stock_origen.existencia or 0) < t.cantidad:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Stock insuficiente en el depósito de origen")
+    stock_origen.existencia -= t.cantidad
+    stocks[destino].existencia = (stocks[destino].existencia or 0) + t.cantidad
+
+    movimientos = [
+        StockMovimiento(
+            producto_id=t.producto_id,
+            deposito_id=deposito_id,
+            cantidad=t.cantidad,
+            tipo=tipo,
+            motivo=t.motivo
+        )
+        for deposito_id, tipo in (
+            (t.deposito_origen_id, schemas.MovimientoTipo.egreso),
+            (t.deposito_destino_id, schemas.MovimientoTipo.ingreso),
+        )
+    ]
+    db.add_all(movimientos)
+    return movimientos
+
+@router.post("/ingreso/", response_model=schemas.StockMovimientoOut)
+def ingreso_stock(
+    mov: schemas.StockMovimientoCreate,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentos seguros"),
+    db: Session = Depends(get_db)
+):
+    ids = ejecutar_idempotente(db, idempotency_key, "ingreso", mov.dict(), lambda s: _registrar_ingreso(s, mov))
+    return db.get(StockMovimiento, ids[0])
+
+@router.post("/egreso/", response_model=schemas.StockMovimientoOut)
+def egreso_stock(
+    mov: schemas.StockMovimientoCreate,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentos seguros"),
+    db: Session = Depends(get_db)
+):
+    ids = ejecutar_idempotente(db, idempotency_key, "egreso", mov.dict(), lambda s: _registrar_egreso(s, mov))
+    return db.get(StockMovimiento, ids[0])
+
+@router.post("/transferencia/", response_model=schemas.StockTransferenciaOut)
+def transferencia_stock(
+    transferencia: schemas.StockTransferenciaCreate,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentos seguros"),
+    db: Session = Depends(get_db)
+):
+    """Mueve stock entre depósitos en una sola transacción: egreso en origen e ingreso en destino"""
+    ids = ejecutar_idempotente(
+        db, idempotency_key, "transferencia", transferencia.dict(),
+        lambda s: _registrar_transferencia(s, transferencia)
+    )
+    return {"egreso": db.get(StockMovimiento, ids[0]), "ingreso": db.get(StockMovimiento, ids[1])}
+
+@router.post("/lote", response_model=schemas.MovimientosLoteOut)
+def movimientos_lote(
+    movs: List[schemas.StockMovimientoCreate],
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentos seguros"),
+    db: Session = Depends(get_db)
+):
+    """Aplica muchas líneas de ingreso/egreso/ajuste de forma atómica: una consulta para
+    cargar el stock, un insert por lotes de los movimientos y un solo commit"""
+    if not movs:
+        return {"ids": []}
+    ids = ejecutar_idempotente(
+        db, idempotency_key, "lote", [m.dict() for m in movs], lambda s: _registrar_lote(s, movs)
+    )
+    return {"ids": ids}
 
-@router.get("/filtro/", response_model=List[schemas.StockMovimientoOut])
+@router.get("/filtro/", response_model=schemas.StockMovimientoPagina)
 def get_movimientos_filtrados(
     producto_id: int = Query(None),
     deposito_id: int = Query(None),
     fecha_ini: datetime = Query(None),
     fecha_fin: datetime = Query(None),
+    cursor: Optional[str] = Query(None, description="next_cursor devuelto por la página anterior"),
+    limit: int = Query(100, ge=1, le=1000, description="Número máximo de registros a retornar"),
     db: Session = Depends(get_db)
 ):
     q = db.query(StockMovimiento)
@@ -70,23 +225,190 @@ def get_movimientos_filtrados(
         q = q.filter(StockMovimiento.fecha >= fecha_ini)
     if fecha_fin:
         q = q.filter(StockMovimiento.fecha <= fecha_fin)
-    return q.order_by(StockMovimiento.fecha.desc()).all()
+    # Los meses archivados se leen de los archivos solo si la página llega hasta ellos
+    archivo = {"producto_id": producto_id, "deposito_id": deposito_id, "fecha_ini": fecha_ini, "fecha_fin": fecha_fin}
+    return _paginar_movimientos(q, cursor, limit, archivo)
+
+@router.get("/diario", response_model=List[schemas.MovimientoDiarioOut])
+def get_movimientos_diarios(
+    desde: date = Query(..., description="Primer día (AAAA-MM-DD)"),
+    hasta: date = Query(..., description="Último día (AAAA-MM-DD)"),
+    deposito_id: Optional[int] = Query(None, description="Filtrar por depósito"),
+    producto_id: Optional[int] = Query(None, description="Filtrar por producto"),
+    db: Session = Depends(get_db)
+):
+    """Ingresos/egresos/ajustes por día y depósito, leídos de la tabla de totales diarios"""
+    query = db.query(
+        StockMovimientoDiario.dia,
+        StockMovimientoDiario.deposito_id,
+        func.sum(StockMovimientoDiario.ingresos).label("ingresos"),
+        func.sum(StockMovimientoDiario.egresos).label("egresos"),
+        func.sum(StockMovimientoDiario.ajustes).label("ajustes"),
+        func.sum(StockMovimientoDiario.movimientos).label("movimientos"),
+    ).filter(StockMovimientoDiario.dia >= desde, StockMovimientoDiario.dia <= hasta)
+    if deposito_id is not None:
+        query = query.filter(StockMovimientoDiario.deposito_id == deposito_id)
+    if producto_id is not None:
+        query = query.filter(StockMovimientoDiario.producto_id == producto_id)
+    grupos = (StockMovimientoDiario.dia, StockMovimientoDiario.deposito_id)
+    return [dict(fila._mapping) for fila in query.group_by(*grupos).order_by(*grupos)]
 
 @router.post("/ajuste/", response_model=schemas.StockMovimientoOut)
-def ajuste_stock(mov: schemas.StockMovimientoCreate, db: Session = Depends(get_db)):
-    stock = db.query(Stock).filter(Stock.producto_id == mov.producto_id, Stock.deposito_id == mov.deposito_id).first()
-    if not stock:
-        stock = Stock(producto_id=mov.producto_id, deposito_id=mov.deposito_id, existencia=0, stock_minimo=0)
-        db.add(stock)
-    stock.existencia += mov.cantidad
-    movimiento = StockMovimiento(
-        producto_id=mov.producto_id,
-        deposito_id=mov.deposito_id,
-        cantidad=mov.cantidad,
-        tipo=schemas.MovimientoTipo.ajuste,
-        motivo=mov.motivo
-    )
-    db.add(movimiento)
-    db.commit()
-    db.refresh(movimiento)
-    return movimiento
+def ajuste_stock(
+    mov: schemas.StockMovimientoCreate,
+    idempotency_key: Optional[str] = Header(None, description="Clave para reintentos seguros"),
+    db: Session = Depends(get_db)
+):
+    ids = ejecutar_idempotente(db, idempotency_key, "ajuste", mov.dict(), lambda s: _registrar_ajuste(s, mov))
+    return db.get(StockMovimiento, ids[0])
+
+def _leer_conteos(archivo: UploadFile, deposito_id: Optional[int], db: Session):
+    """Lee el CSV de conteo línea a línea y acumula cantidades por (producto_id, deposito_id).
+    Acepta producto_id o codigo para identificar el producto; deposito_id puede venir por query."""
+    texto = io.TextIOWrapper(archivo.file, encoding="utf-8-sig", newline="")
+    encabezado = texto.readline()
+    try:
+        dialecto = csv.Sniffer().sniff(encabezado, delimiters=",;\t")
+    except csv.Error:
+        dialecto = csv.excel
+    columnas = [c.strip().lower() for c in next(csv.reader([encabezado], dialecto), [])]
+    columna_cantidad = "cantidad" if "cantidad" in columnas else "conteo"
+    if columna_cantidad not in columnas or not ({"producto_id", "codigo"} & set(columnas)):
+        raise HTTPException(status_code=400, detail="El CSV debe tener columnas producto_id (o codigo) y cantidad")
+    if "deposito_id" not in columnas and deposito_id is None:
+        raise HTTPException(status_code=400, detail="Falta la columna deposito_id o el parámetro deposito_id")
+
+    conteos = {}
+    por_codigo = {}
+    errores = []
+    lineas = 0
+    for numero, valores in enumerate(csv.reader(texto, dialecto), start=2):
+        if not any(v.strip() for v in valores):
+            continue
+        lineas += 1
+        fila = dict(zip(columnas, (v.strip() for v in valores)))
+        try:
+            cantidad = float(fila[columna_cantidad].replace(",", "."))
+            deposito = int(fila["deposito_id"]) if fila.get("deposito_id") else deposito_id
+            if deposito is None:
+                raise ValueError("sin depósito")
+            if fila.get("producto_id"):
+                clave = (int(fila["producto_id"]), deposito)
+                conteos[clave] = conteos.get(clave, 0) + cantidad
+            elif fila.get("codigo"):
+                clave = (fila["codigo"], deposito)
+                por_codigo[clave] = por_codigo.get(clave, 0) + cantidad
+            else:
+                raise ValueError("sin producto")
+        except (KeyError, ValueError) as e:
+            errores.append(f"Línea {numero}: {e}")
+
+    if por_codigo:
+        ids_por_codigo = dict(
+            db.query(Producto.codigo, Producto.id)
+            .filter(Producto.codigo.in_({codigo for codigo, _ in por_codigo}))
+            .all()
+        )
+        for (codigo, deposito), cantidad in por_codigo.items():
+            if codigo not in ids_por_codigo:
+                errores.append(f"Código {codigo} no encontrado")
+                continue
+            clave = (ids_por_codigo[codigo], deposito)
+            conteos[clave] = conteos.get(clave, 0) + cantidad
+
+    # Ids que no existen fallarían recién al grabar (FK): se informan junto con los demás errores
+    productos = {producto_id for producto_id, _ in conteos}
+    depositos = {deposito for _, deposito in conteos}
+    productos_existentes = {i for (i,) in db.query(Producto.id).filter(Producto.id.in_(productos))} if productos else set()
+    depositos_existentes = {i for (i,) in db.query(Deposito.id).filter(Deposito.id.in_(depositos))} if depositos else set()
+    errores.extend(f"Producto {producto_id} no encontrado" for producto_id in sorted(productos - productos_existentes))
+    errores.extend(f"Depósito {deposito} no encontrado" for deposito in sorted(depositos - depositos_existentes))
+
+    if errores:
+        raise HTTPException(status_code=400, detail={"errores": errores[:50], "total_errores": len(errores)})
+    return conteos, lineas
+
+@router.post("/inventario/", response_model=schemas.InventarioResultado)
+def toma_inventario(
+    archivo: UploadFile = File(..., description="CSV con producto_id (o codigo), deposito_id y cantidad contada"),
+    deposito_id: Optional[int] = Query(None, description="Depósito para las líneas que no lo indican"),
+    simular: bool = Query(False, description="Solo calcular las diferencias, sin grabar"),
+    motivo: str = Query("Toma de inventario", description="Motivo de los movimientos de ajuste"),
+    db: Session = Depends(get_db)
+):
+    """Registra un conteo físico: calcula las diferencias contra Stock.existencia y graba
+    todos los ajustes y la nueva existencia en una sola transacción"""
+    conteos, lineas = _leer_conteos(archivo, deposito_id, db)
+
+    # Una sola consulta para el stock de los pares contados; se bloquea hasta el commit (en orden
+    # de id, como bloquear_filas_stock) para que un movimiento concurrente no quede fuera del ajuste
+    stock_actual = {}
+    if conteos:
+        query = db.query(Stock.id, Stock.producto_id, Stock.deposito_id, Stock.existencia, Stock.stock_minimo) \
+            .filter(tuple_(Stock.producto_id, Stock.deposito_id).in_(list(conteos))) \
+            .order_by(Stock.id)
+        if not simular:
+            query = query.with_for_update()
+        stock_actual = {(fila.producto_id, fila.deposito_id): fila for fila in query}
+
+    diferencias = []
+    sin_diferencia = 0
+    for (producto_id, deposito), contado in conteos.items():
+        fila = stock_actual.get((producto_id, deposito))
+        existencia = fila.existencia if fila else 0
+        diferencia = contado - existencia
+        if abs(diferencia) < 1e-9:
+            sin_diferencia += 1
+            continue
+        diferencias.append({
+            "producto_id": producto_id,
+            "deposito_id": deposito,
+            "existencia_anterior": existencia,
+            "contado": contado,
+            "diferencia": diferencia,
+        })
+
+    if not simular and diferencias:
+        fecha = datetime.utcnow()
+        actualizaciones = []
+        nuevos = []
+        modificados = []
+        for d in diferencias:
+            fila = stock_actual.get((d["producto_id"], d["deposito_id"]))
+            if fila:
+                actualizaciones.append({"id": fila.id, "existencia": d["contado"]})
+                modificados.append({
+                    "id": fila.id, "producto_id": fila.producto_id, "deposito_id": fila.deposito_id,
+                    "existencia": d["contado"], "stock_minimo": fila.stock_minimo
+                })
+            else:
+                nuevos.append({
+                    "producto_id": d["producto_id"], "deposito_id": d["deposito_id"],
+                    "existencia": d["contado"], "stock_minimo": 0
+                })
+                modificados.append(dict(nuevos[-1], id=None))
+        db.bulk_update_mappings(Stock, actualizaciones)
+        db.bulk_insert_mappings(Stock, nuevos)
+        ajustes = [
+            {
+                "producto_id": d["producto_id"],
+                "deposito_id": d["deposito_id"],
+                "cantidad": d["diferencia"],
+                "tipo": schemas.MovimientoTipo.ajuste,
+                "motivo": motivo,
+                "fecha": fecha,
+            }
+            for d in diferencias
+        ]
+        db.bulk_insert_mappings(StockMovimiento, ajustes)
+        acumular_en_rollup(db, ajustes)
+        marcar_stock_modificado(db, modificados)
+        db.commit()
+
+    return {
+        "simulado": simular,
+        "lineas": lineas,
+        "ajustes": len(diferencias),
+        "sin_diferencia": sin_diferencia,
+        "diferencias": diferencias,
+    }
@@ -1,24 +1,51 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
 from database import get_db
-from models import Producto, Stock, StockMovimiento, MovimientoTipo
-import requests, os
-from dotenv import load_dotenv
-
-load_dotenv()
+from typing import Optional
+from models import (
+    Producto, StockMovimiento, MovimientoTipo, SyncOrdenesEstado, SyncOrdenesParte, SyncOrdenesPendiente
+)
+from servicios.operaciones_stock import bloquear_filas_stock, insert_con_conflicto
+from servicios.rollup_movimientos import acumular_en_rollup
+from servicios.api_partes import paginas_partes
+from servicios.archivo_movimientos import egresos_archivados
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
 
 router = APIRouter(prefix="/stock", tags=["stock"])
 
-@router.post("/sync-ordenes/")
-def sync_ordenes(db: Session = Depends(get_db)):
-    API_URL = "https://api.partedetrabajo.com/v1/partes/"
-    HEADERS = {"X-Auth-Partedetrabajo-Token": os.getenv("API_TOKEN")}
-    print("Iniciando sincronización de órdenes externas...")
-    response = requests.get(API_URL, headers=HEADERS)
-    response.raise_for_status()
-    partes = response.json().get("docs", [])
-    print(f"Órdenes recibidas: {len(partes)}")
-    movimientos = 0
+DEPOSITO_ORDENES = 1
+
+def _registrar_egresos_partes(db: Session, partes: list, pendientes: Optional[set] = None) -> int:
+    """Registra los egresos de las líneas de producto de los partes.
+    Carga productos, egresos ya registrados y stock con una consulta IN cada uno y después
+    trabaja en memoria; los movimientos se insertan juntos al final. Los partes con alguna
+    línea omitida (producto desconocido o sin stock) se agregan a `pendientes`."""
+    ids_producto_api = {linea["producto_id"] for parte in partes for linea in parte.get("lineasProducto", [])}
+    if not ids_producto_api:
+        return 0
+    productos = {
+        p.id_producto: p.id
+        for p in db.query(Producto.id, Producto.id_producto).filter(Producto.id_producto.in_(ids_producto_api))
+    }
+    ids_parte = {parte["id"] for parte in partes}
+    ya_registrados = set()
+    if productos:
+        ya_registrados = set(
+            db.query(StockMovimiento.producto_id, StockMovimiento.motivo).filter(
+                StockMovimiento.producto_id.in_(set(productos.values())),
+                StockMovimiento.motivo.in_(ids_parte),
+                StockMovimiento.tipo == MovimientoTipo.egreso
+            )
+        )
+        # Los egresos ya archivados no están en la tabla pero también cuentan
+        ya_registrados |= egresos_archivados(db, set(productos.values()), ids_parte)
+    stocks = bloquear_filas_stock(db, {(producto_id, DEPOSITO_ORDENES) for producto_id in productos.values()})
+
+    fecha = datetime.utcnow()
+    movimientos = []
     for parte in partes:
         parte_id = parte["id"]
         cliente_id = parte.get("cliente_id")
@@ -28,38 +55,168 @@ def sync_ordenes(db: Session = Depends(get_db)):
             id_producto_api = linea["producto_id"]
             unidades = linea["unidades"]
             print(f"  Producto API: {id_producto_api}, Unidades: {unidades}")
-            producto = db.query(Producto).filter(Producto.id_producto == id_producto_api).first()
-            if not producto:
+            producto_id = productos.get(id_producto_api)
+            if producto_id is None:
                 print(f"    Producto {id_producto_api} no encontrado en base local, se omite.")
+                if pendientes is not None:
+                    pendientes.add(parte_id)
                 continue
-            existe = db.query(StockMovimiento).filter(
-                StockMovimiento.producto_id == producto.id,
-                StockMovimiento.motivo == parte_id,
-                StockMovimiento.tipo == MovimientoTipo.egreso
-            ).first()
-            if existe:
-                print(f"    Ya existe movimiento de egreso para parte {parte_id} y producto {producto.id}, se omite.")
+            if (producto_id, parte_id) in ya_registrados:
+                print(f"    Ya existe movimiento de egreso para parte {parte_id} y producto {producto_id}, se omite.")
                 continue
-            stock = db.query(Stock).filter(Stock.producto_id == producto.id, Stock.deposito_id == 1).first()
+            stock = stocks.get((producto_id, DEPOSITO_ORDENES))
             if not stock:
-                print(f"    No hay stock para producto {producto.id} en depósito 1, se omite.")
+                print(f"    No hay stock para producto {producto_id} en depósito {DEPOSITO_ORDENES}, se omite.")
+                if pendientes is not None:
+                    pendientes.add(parte_id)
                 continue
             if stock.existencia < unidades:
-                print(f"    Stock insuficiente para producto {producto.id}: {stock.existencia} < {unidades}, se omite.")
+                print(f"    Stock insuficiente para producto {producto_id}: {stock.existencia} < {unidades}, se omite.")
+                if pendientes is not None:
+                    pendientes.add(parte_id)
                 continue
             stock.existencia -= unidades
-            movimiento = StockMovimiento(
-                producto_id=producto.id,
-                deposito_id=stock.deposito_id,
-                cantidad=unidades,
-                tipo=MovimientoTipo.egreso,
-                motivo=parte_id,
-                cliente_id=cliente_id,
-                cliente_empresa=cliente_empresa
-            )
-            db.add(movimiento)
-            movimientos += 1
-            print(f"    Movimiento de egreso registrado para producto {producto.id}, parte {parte_id}, cliente {cliente_id}, empresa {cliente_empresa}, unidades {unidades}")
+            movimientos.append({
+                "producto_id": producto_id,
+                "deposito_id": stock.deposito_id,
+                "cantidad": unidades,
+                "tipo": MovimientoTipo.egreso,
+                "motivo": parte_id,
+                "cliente_id": cliente_id,
+                "cliente_empresa": cliente_empresa,
+                "fecha": fecha,
+            })
+            print(f"    Movimiento de egreso registrado para producto {producto_id}, parte {parte_id}, cliente {cliente_id}, empresa {cliente_empresa}, unidades {unidades}")
+
+    if movimientos:
+        db.bulk_insert_mappings(StockMovimiento, movimientos)
+        acumular_en_rollup(db, movimientos)
+    return len(movimientos)
+
+def huella_parte(parte: dict) -> str:
+    """_rev del documento si la API lo manda; si no, hash de lo que afecta al stock"""
+    if parte.get("_rev"):
+        return parte["_rev"]
+    contenido = json.dumps(
+        {"estado": parte.get("estado"), "lineasProducto": parte.get("lineasProducto", [])},
+        sort_keys=True
+    )
+    return hashlib.sha1(contenido.encode("utf-8")).hexdigest()
+
+def _partes_sin_procesar(db: Session, partes: list) -> list:
+    """Deja solo los partes nuevos o cuya huella cambió desde la última corrida"""
+    huellas = dict(
+        db.query(SyncOrdenesParte.parte_id, SyncOrdenesParte.huella)
+        .filter(SyncOrdenesParte.parte_id.in_({parte["id"] for parte in partes}))
+    )
+    return [parte for parte in partes if huellas.get(parte["id"]) != huella_parte(parte)]
+
+def _marcar_procesados(db: Session, partes: list):
+    if not partes:
+        return
+    insert = insert_con_conflicto(db)
+    stmt = insert(SyncOrdenesParte)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SyncOrdenesParte.parte_id],
+        set_={"huella": stmt.excluded.huella, "procesado": stmt.excluded.procesado}
+    )
+    ahora = datetime.utcnow()
+    db.execute(stmt, [
+        {"parte_id": parte["id"], "huella": huella_parte(parte), "procesado": ahora}
+        for parte in partes
+    ])
+
+def _procesar_partes(db: Session, partes: list) -> int:
+    """Registra los egresos, guarda la huella de cada parte y actualiza la lista de pendientes"""
+    if not partes:
+        return 0
+    pendientes = set()
+    movimientos = _registrar_egresos_partes(db, partes, pendientes)
+    _marcar_procesados(db, partes)
+    db.query(SyncOrdenesPendiente) \
+        .filter(SyncOrdenesPendiente.parte_id.in_({parte["id"] for parte in partes} - pendientes)) \
+        .delete(synchronize_session=False)
+    if pendientes:
+        insert = insert_con_conflicto(db)
+        stmt = insert(SyncOrdenesPendiente)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SyncOrdenesPendiente.parte_id],
+            set_={"documento": stmt.excluded.documento}
+        )
+        db.execute(stmt, [
+            {"parte_id": parte["id"], "documento": json.dumps(parte), "desde": datetime.utcnow()}
+            for parte in partes if parte["id"] in pendientes
+        ])
+    return movimientos
+
+# Cada cuánto una corrida incremental pasa a ser completa (partes editados en páginas viejas)
+HORAS_ENTRE_COMPLETAS = float(os.getenv("SYNC_ORDENES_COMPLETA_HORAS", "24"))
+
+@router.post("/sync-ordenes/")
+def sync_ordenes(
+    completa: bool = Query(False, description="Recorrer todas las páginas, no solo las nuevas"),
+    db: Session = Depends(get_db)
+):
+    """Sigue desde el último bookmark guardado y procesa solo partes nuevos o modificados.
+    Cada página se procesa y confirma junto con la marca de agua antes de pedir la siguiente,
+    así una corrida cortada retoma donde quedó.
+
+    La API no informa fecha de modificación, así que un parte editado en una página ya leída
+    solo se ve al recorrer desde el principio: eso pasa solo cada SYNC_ORDENES_COMPLETA_HORAS
+    (o con completa=true). Los partes con líneas omitidas se reintentan en todas las corridas:
+    si aparecen en alguna página se usa el documento recibido (puede haber cambiado); los que
+    no aparecen se reintentan al final desde el documento guardado en sync_ordenes_pendientes."""
+    estado = db.get(SyncOrdenesEstado, 1)
+    if estado is None:
+        estado = SyncOrdenesEstado(id=1)
+        db.add(estado)
+    inicio = datetime.utcnow()
+    if estado.ultima_completa is None or inicio - estado.ultima_completa >= timedelta(hours=HORAS_ENTRE_COMPLETAS):
+        completa = True
+    bookmark = None if completa else estado.bookmark
+    print(f"Iniciando sincronización de órdenes externas{' completa' if completa else ''}...")
+    con_pendientes = {parte_id for (parte_id,) in db.query(SyncOrdenesPendiente.parte_id)}
+
+    partes = 0
+    procesados = 0
+    movimientos = 0
+    vistos = set()
+    for docs, siguiente in paginas_partes(bookmark):
+        partes += len(docs)
+        vistos.update(parte["id"] for parte in docs)
+        nuevos = _partes_sin_procesar(db, docs)
+        ids_nuevos = {parte["id"] for parte in nuevos}
+        # Un pendiente sin cambios no pasa el filtro de huella pero se reintenta con esta versión
+        nuevos += [parte for parte in docs if parte["id"] in con_pendientes and parte["id"] not in ids_nuevos]
+        movimientos += _procesar_partes(db, nuevos)
+        procesados += len(nuevos)
+        # Se guarda el bookmark de esta página (no el de la siguiente): la última página
+        # puede seguir creciendo y se vuelve a leer en la próxima corrida
+        estado = db.get(SyncOrdenesEstado, 1) or estado
+        estado.bookmark = bookmark
+        estado.actualizado = datetime.utcnow()
+        db.commit()
+        db.expunge_all()
+        bookmark = siguiente
+
+    reintentos = [
+        json.loads(p.documento)
+        for p in db.query(SyncOrdenesPendiente).order_by(SyncOrdenesPendiente.parte_id)
+        if p.parte_id not in vistos
+    ]
+    movimientos += _procesar_partes(db, reintentos)
+
+    estado = db.get(SyncOrdenesEstado, 1) or estado
+    if completa:
+        estado.ultima_completa = inicio
     db.commit()
+    pendientes = db.query(SyncOrdenesPendiente).count()
+    print(f"Órdenes recibidas: {partes}, nuevas o modificadas: {procesados}, pendientes: {pendientes}")
     print(f"Sincronización completa. Movimientos registrados: {movimientos}")
-    return {"msg": f"Sincronización completa. Movimientos registrados: {movimientos}"}
+    return {
+        "msg": f"Sincronización completa. Movimientos registrados: {movimientos}",
+        "partes": partes,
+        "procesados": procesados,
+        "pendientes": pendientes,
+        "movimientos": movimientos,
+    }
@@ -1,5 +1,6 @@
 from pydantic import BaseModel
 from typing import Optional, List
+from datetime import datetime, date
 
 class StockBase(BaseModel):
     producto_id: int
@@ -19,6 +20,93 @@ class StockOut(StockBase):
     class Config:
         from_attributes = True
 
+class StockPagina(BaseModel):
+    """Página de stock con cursor por id para pedir la siguiente"""
+    items: List[StockOut]
+    next_cursor: Optional[int] = None
+    total_aproximado: Optional[int] = None
+
+class StockVistaOut(StockOut):
+    """Fila de stock con los nombres de producto, depósito, rubro y marca ya resueltos"""
+    producto_codigo: Optional[str] = None
+    producto_descripcion: Optional[str] = None
+    deposito_nombre: Optional[str] = None
+    rubro_nombre: Optional[str] = None
+    marca_nombre: Optional[str] = None
+
+class StockVistaPagina(BaseModel):
+    items: List[StockVistaOut]
+    next_cursor: Optional[int] = None
+
+class StockLoteItem(BaseModel):
+    """Actualización de una fila identificada por stock_id o por (producto_id, deposito_id)"""
+    stock_id: Optional[int] = None
+    producto_id: Optional[int] = None
+    deposito_id: Optional[int] = None
+    existencia: Optional[float] = None
+    stock_minimo: Optional[float] = None
+
+class StockLoteResultado(BaseModel):
+    indice: int
+    stock_id: Optional[int] = None
+    estado: str  # actualizado, no_encontrado o invalido
+    detalle: Optional[str] = None
+
+class StockResumenOut(BaseModel):
+    """Totales de stock de un grupo; solo vienen cargadas las dimensiones pedidas en agrupar"""
+    rubro_id: Optional[int] = None
+    rubro_nombre: Optional[str] = None
+    marca_id: Optional[int] = None
+    marca_nombre: Optional[str] = None
+    proveedor_id: Optional[int] = None
+    proveedor_nombre: Optional[str] = None
+    deposito_id: Optional[int] = None
+    deposito_nombre: Optional[str] = None
+    filas: int
+    productos: int
+    existencia_total: float
+    bajo_minimo: int
+
+class StockDiscrepanciaOut(BaseModel):
+    producto_id: int
+    deposito_id: int
+    existencia: float
+    movimientos: float
+    diferencia: float
+
+class StockConsistenciaOut(BaseModel):
+    revisadas: int
+    discrepancias: List[StockDiscrepanciaOut]
+    corregidas: int
+
+class StockHistoricoItem(BaseModel):
+    producto_id: int
+    deposito_id: int
+    existencia: float
+
+class StockHistoricoOut(BaseModel):
+    """Existencia reconstruida a una fecha; snapshot es la foto usada como punto de partida"""
+    fecha: datetime
+    snapshot: Optional[datetime] = None
+    items: List[StockHistoricoItem]
+
+class StockAlertaOut(BaseModel):
+    id: int
+    producto_id: int
+    deposito_id: int
+    existencia: float
+    stock_minimo: float
+    faltante: float
+    producto_codigo: Optional[str] = None
+    producto_descripcion: Optional[str] = None
+    deposito_nombre: Optional[str] = None
+
+class StockAlertasProveedor(BaseModel):
+    """Alertas de stock bajo el mínimo agrupadas por proveedor para reposición"""
+    proveedor_id: Optional[int] = None
+    proveedor_nombre: Optional[str] = None
+    items: List[StockAlertaOut]
+
 
 # --- Marca Schemas ---
 class MarcaBase(BaseModel):
@@ -179,6 +267,48 @@ class StockMovimientoOut(StockMovimientoBase):
     class Config:
         from_attributes = True
 
+class StockMovimientoPagina(BaseModel):
+    """Página de movimientos (más nuevos primero); next_cursor se pasa como cursor para seguir"""
+    items: List[StockMovimientoOut]
+    next_cursor: Optional[str] = None
+
+class MovimientoDiarioOut(BaseModel):
+    dia: date
+    deposito_id: int
+    ingresos: float
+    egresos: float
+    ajustes: float
+    movimientos: int
+
+class StockTransferenciaCreate(BaseModel):
+    producto_id: int
+    deposito_origen_id: int
+    deposito_destino_id: int
+    cantidad: float
+    motivo: str
+
+class StockTransferenciaOut(BaseModel):
+    egreso: StockMovimientoOut
+    ingreso: StockMovimientoOut
+
+class MovimientosLoteOut(BaseModel):
+    ids: List[int]
+
+class InventarioDiferencia(BaseModel):
+    producto_id: int
+    deposito_id: int
+    existencia_anterior: float
+    contado: float
+    diferencia: float
+
+class InventarioResultado(BaseModel):
+    """Resultado (o vista previa si simulado) de una toma de inventario"""
+    simulado: bool
+    lineas: int
+    ajustes: int
+    sin_diferencia: int
+    diferencias: List[InventarioDiferencia]
+
 # --- Tecnico Schemas ---
 class TecnicoBase(BaseModel):
     nombre: str
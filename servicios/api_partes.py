@@ -0,0 +1,41 @@
+import os
+from typing import Iterator, Optional, Tuple
+import requests
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_URL = "https://api.partedetrabajo.com/v1/partes/"
+
+def encabezados() -> dict:
+    return {"X-Auth-Partedetrabajo-Token": os.getenv("API_TOKEN")}
+
+def paginas_partes(
+    bookmark: Optional[str] = None,
+    max_paginas: Optional[int] = None,
+    timeout: float = 30
+) -> Iterator[Tuple[list, Optional[str]]]:
+    """Recorre la API de partes página por página siguiendo el bookmark, sin acumularlas.
+    Genera (docs, bookmark) donde bookmark es el que pide la página siguiente."""
+    pagina = 1
+    while max_paginas is None or pagina <= max_paginas:
+        params = {"bookmark": bookmark} if bookmark else None
+        response = requests.get(API_URL, headers=encabezados(), params=params, timeout=timeout)
+        response.raise_for_status()
+        data = response.json()
+
+        docs = data.get("docs", [])
+        nuevo_bookmark = data.get("bookmark")
+        if not docs:
+            print(f"📄 Página {pagina}: No hay más documentos")
+            return
+
+        print(f"📄 Página {pagina}: {len(docs)} partes obtenidos")
+        yield docs, nuevo_bookmark
+
+        # Si no hay nuevo bookmark o es igual al anterior, terminamos
+        if not nuevo_bookmark or nuevo_bookmark == bookmark:
+            print(f"📄 Página {pagina}: No hay más páginas (bookmark)")
+            return
+        bookmark = nuevo_bookmark
+        pagina += 1
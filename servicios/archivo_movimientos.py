@@ -0,0 +1,307 @@
+import gzip
+import json
+import os
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+from models import (
+    StockMovimiento, StockMovimientoArchivoMes, StockMovimientoArchivoSaldo, StockMovimientoArchivoEgreso,
+    StockMovimientoArchivoPar, MovimientoTipo
+)
+from servicios.operaciones_stock import insert_con_conflicto
+
+# Un directorio por mes con archivos JSONL comprimidos que nunca se modifican:
+#   archivo_movimientos/2024-03/000000123456.jsonl.gz  (nombre = id del primer movimiento)
+DIRECTORIO_ARCHIVO = os.getenv("STOCK_ARCHIVO_DIR", "archivo_movimientos")
+FILAS_POR_LOTE = 5000
+
+def _mes(fecha: datetime) -> str:
+    return f"{fecha.year:04d}-{fecha.month:02d}"
+
+def _serializar(mov: StockMovimiento) -> dict:
+    return {
+        "id": mov.id,
+        "producto_id": mov.producto_id,
+        "deposito_id": mov.deposito_id,
+        "cantidad": mov.cantidad,
+        "tipo": mov.tipo.value,
+        "motivo": mov.motivo,
+        "fecha": mov.fecha.isoformat(),
+        "cliente_id": mov.cliente_id,
+        "cliente_empresa": mov.cliente_empresa,
+    }
+
+def _deserializar(datos: dict) -> StockMovimiento:
+    """Objeto transitorio (fuera de la sesión) para devolverlo igual que las filas de la base"""
+    return StockMovimiento(
+        **dict(datos, tipo=MovimientoTipo(datos["tipo"]), fecha=datetime.fromisoformat(datos["fecha"]))
+    )
+
+def _escribir_parte(mes: str, movimientos: list):
+    """Escribe un archivo nuevo de forma atómica (temporal + fsync + rename). Si el commit
+    posterior falla, el próximo intento arranca por el mismo id y lo reemplaza."""
+    directorio = os.path.join(DIRECTORIO_ARCHIVO, mes)
+    os.makedirs(directorio, exist_ok=True)
+    destino = os.path.join(directorio, f"{movimientos[0].id:012d}.jsonl.gz")
+    temporal = destino + ".tmp"
+    with open(temporal, "wb") as crudo:
+        with gzip.GzipFile(fileobj=crudo, mode="wb") as archivo:
+            for mov in movimientos:
+                archivo.write((json.dumps(_serializar(mov)) + "\n").encode("utf-8"))
+        crudo.flush()
+        os.fsync(crudo.fileno())
+    os.replace(temporal, destino)
+
+def _acumular_saldos(db: Session, movimientos: list):
+    saldos = {}
+    for mov in movimientos:
+        fila = saldos.setdefault((mov.producto_id, mov.deposito_id), {
+            "producto_id": mov.producto_id, "deposito_id": mov.deposito_id, "cantidad": 0, "movimientos": 0
+        })
+        fila["cantidad"] += -mov.cantidad if mov.tipo == MovimientoTipo.egreso else mov.cantidad
+        fila["movimientos"] += 1
+    tabla = StockMovimientoArchivoSaldo.__table__
+    stmt = insert_con_conflicto(db)(tabla)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[tabla.c.producto_id, tabla.c.deposito_id],
+        set_={
+            "cantidad": tabla.c.cantidad + stmt.excluded.cantidad,
+            "movimientos": tabla.c.movimientos + stmt.excluded.movimientos,
+        }
+    )
+    db.execute(stmt, list(saldos.values()))
+
+def _registrar_egresos(db: Session, movimientos: list):
+    """Guarda (producto, motivo) de los egresos para que el control de duplicados de
+    sync-ordenes no dependa de que el movimiento siga en la tabla"""
+    egresos = {
+        (mov.producto_id, mov.motivo)
+        for mov in movimientos
+        if mov.tipo == MovimientoTipo.egreso and mov.motivo
+    }
+    if not egresos:
+        return
+    stmt = insert_con_conflicto(db)(StockMovimientoArchivoEgreso).on_conflict_do_nothing(
+        index_elements=[StockMovimientoArchivoEgreso.producto_id, StockMovimientoArchivoEgreso.motivo]
+    )
+    db.execute(stmt, [{"producto_id": p, "motivo": m} for p, m in sorted(egresos)])
+
+def _registrar_pares(db: Session, mes: str, movimientos: list):
+    pares = {(mov.producto_id, mov.deposito_id) for mov in movimientos}
+    stmt = insert_con_conflicto(db)(StockMovimientoArchivoPar).on_conflict_do_nothing(
+        index_elements=[
+            StockMovimientoArchivoPar.mes, StockMovimientoArchivoPar.producto_id, StockMovimientoArchivoPar.deposito_id
+        ]
+    )
+    db.execute(stmt, [{"mes": mes, "producto_id": p, "deposito_id": d} for p, d in sorted(pares)])
+
+def egresos_archivados(db: Session, producto_ids: set, motivos: set) -> set:
+    """{(producto_id, motivo)} de egresos archivados entre los productos y motivos pedidos"""
+    if not producto_ids or not motivos:
+        return set()
+    return set(
+        db.query(StockMovimientoArchivoEgreso.producto_id, StockMovimientoArchivoEgreso.motivo).filter(
+            StockMovimientoArchivoEgreso.producto_id.in_(producto_ids),
+            StockMovimientoArchivoEgreso.motivo.in_(motivos)
+        )
+    )
+
+def reconstruir_registros_archivo(db: Session) -> int:
+    """Vuelve a cargar el registro de egresos y de pares por mes leyendo todos los meses archivados"""
+    total = 0
+    for (mes,) in db.query(StockMovimientoArchivoMes.mes).order_by(StockMovimientoArchivoMes.mes):
+        movimientos = [_deserializar(datos) for datos in _leer_mes(mes)]
+        if movimientos:
+            _registrar_egresos(db, movimientos)
+            _registrar_pares(db, mes, movimientos)
+        total += len(movimientos)
+    return total
+
+def archivar_movimientos(db: Session, antes_de: datetime, filas_por_lote: int = FILAS_POR_LOTE) -> int:
+    """Mueve a archivos los movimientos con fecha anterior a `antes_de`, en orden (fecha, id) y
+    por lotes: cada lote se escribe a disco y después se borra de la tabla en una transacción
+    que también actualiza los meses archivados, los saldos por producto/depósito y los registros
+    de egresos y de pares por mes."""
+    total = 0
+    while True:
+        lote = db.query(StockMovimiento) \
+            .filter(StockMovimiento.fecha < antes_de) \
+            .order_by(StockMovimiento.fecha, StockMovimiento.id) \
+            .limit(filas_por_lote).all()
+        if not lote:
+            break
+
+        por_mes = {}
+        for mov in lote:
+            por_mes.setdefault(_mes(mov.fecha), []).append(mov)
+        for mes, movimientos in por_mes.items():
+            _escribir_parte(mes, movimientos)
+            registro = db.get(StockMovimientoArchivoMes, mes)
+            if registro is None:
+                registro = StockMovimientoArchivoMes(mes=mes, filas=0, hasta=movimientos[-1].fecha)
+                db.add(registro)
+            registro.filas += len(movimientos)
+            registro.hasta = max(registro.hasta, movimientos[-1].fecha)
+            registro.hasta_id = max([registro.hasta_id or 0] + [mov.id for mov in movimientos])
+            _registrar_pares(db, mes, movimientos)
+
+        _acumular_saldos(db, lote)
+        _registrar_egresos(db, lote)
+        ultima = lote[-1].fecha
+        db.query(StockMovimiento) \
+            .filter(StockMovimiento.id.in_([mov.id for mov in lote])) \
+            .delete(synchronize_session=False)
+        db.commit()
+        db.expunge_all()
+        total += len(lote)
+        print(f"📦 {total} movimientos archivados (hasta {ultima.isoformat()})")
+    return total
+
+def archivado_hasta(db: Session) -> Optional[datetime]:
+    """Fecha del movimiento archivado más nuevo; todo lo posterior está en la tabla"""
+    return db.query(func.max(StockMovimientoArchivoMes.hasta)).scalar()
+
+def _leer_mes(mes: str):
+    """Movimientos archivados de un mes, de a una línea (el mes nunca se carga entero en memoria)"""
+    directorio = os.path.join(DIRECTORIO_ARCHIVO, mes)
+    if not os.path.isdir(directorio):
+        print(f"⚠️ Falta el directorio de archivo {directorio}")
+        return
+    for nombre in sorted(os.listdir(directorio)):
+        if nombre.endswith(".jsonl.gz"):
+            with gzip.open(os.path.join(directorio, nombre), "rt", encoding="utf-8") as archivo:
+                for linea in archivo:
+                    yield json.loads(linea)
+
+def _meses_con(db: Session, producto_id: Optional[int] = None, deposito_id: Optional[int] = None):
+    """Consulta de meses archivados; con producto o depósito, solo los que tienen movimientos
+    de ellos según stock_movimientos_archivo_pares (un mes sin pares registrados, archivado
+    antes de que existiera el registro, se lee igual)"""
+    meses = db.query(StockMovimientoArchivoMes.mes)
+    if producto_id is None and deposito_id is None:
+        return meses
+    condiciones = [StockMovimientoArchivoPar.mes == StockMovimientoArchivoMes.mes]
+    if producto_id is not None:
+        condiciones.append(StockMovimientoArchivoPar.producto_id == producto_id)
+    if deposito_id is not None:
+        condiciones.append(StockMovimientoArchivoPar.deposito_id == deposito_id)
+    con_pares = select(StockMovimientoArchivoPar.mes).where(and_(*condiciones)).exists()
+    sin_registro = ~select(StockMovimientoArchivoPar.mes) \
+        .where(StockMovimientoArchivoPar.mes == StockMovimientoArchivoMes.mes).exists()
+    return meses.filter(or_(con_pares, sin_registro))
+
+def completar_con_archivo(
+    db: Session,
+    filas: list,
+    limite: int,
+    posicion: Optional[tuple] = None,
+    producto_id: Optional[int] = None,
+    deposito_id: Optional[int] = None,
+    fecha_ini: Optional[datetime] = None,
+    fecha_fin: Optional[datetime] = None,
+) -> list:
+    """Completa una página de movimientos (fecha desc, id desc) con los archivados, solo si la
+    página puede llegar a fechas archivadas. Lee los meses de más nuevo a más viejo y corta en
+    cuanto junta `limite` filas."""
+    hasta = archivado_hasta(db)
+    if hasta is None or (fecha_ini and fecha_ini > hasta):
+        return filas
+    if len(filas) >= limite and filas[-1].fecha > hasta:
+        return filas
+
+    meses = _meses_con(db, producto_id, deposito_id).order_by(StockMovimientoArchivoMes.mes.desc())
+    topes = [f for f in (fecha_fin, posicion[0] if posicion else None) if f]
+    if topes:
+        meses = meses.filter(StockMovimientoArchivoMes.mes <= _mes(min(topes)))
+    if fecha_ini:
+        meses = meses.filter(StockMovimientoArchivoMes.mes >= _mes(fecha_ini))
+
+    archivadas = []
+    for (mes,) in meses:
+        encontradas = []
+        for datos in _leer_mes(mes):
+            if producto_id and datos["producto_id"] != producto_id:
+                continue
+            if deposito_id and datos["deposito_id"] != deposito_id:
+                continue
+            mov = _deserializar(datos)
+            if fecha_ini and mov.fecha < fecha_ini:
+                continue
+            if fecha_fin and mov.fecha > fecha_fin:
+                continue
+            if posicion and (mov.fecha, mov.id) >= posicion:
+                continue
+            encontradas.append(mov)
+        archivadas.extend(sorted(encontradas, key=lambda m: (m.fecha, m.id), reverse=True))
+        if len(archivadas) >= limite:
+            break
+
+    combinadas = sorted(filas + archivadas, key=lambda m: (m.fecha, m.id), reverse=True)
+    return combinadas[:limite]
+
+def saldos_archivados(db: Session, producto_id: Optional[int] = None, desde: Optional[int] = None,
+                      hasta: Optional[int] = None) -> dict:
+    """{(producto_id, deposito_id): suma con signo} de los movimientos archivados"""
+    query = db.query(
+        StockMovimientoArchivoSaldo.producto_id,
+        StockMovimientoArchivoSaldo.deposito_id,
+        StockMovimientoArchivoSaldo.cantidad
+    )
+    if producto_id is not None:
+        query = query.filter(StockMovimientoArchivoSaldo.producto_id == producto_id)
+    if desde is not None and hasta is not None:
+        query = query.filter(StockMovimientoArchivoSaldo.producto_id.between(desde, hasta))
+    return {(f.producto_id, f.deposito_id): f.cantidad for f in query}
+
+def sumar_archivados(
+    db: Session,
+    hasta: datetime,
+    desde: Optional[datetime] = None,
+    producto_id: Optional[int] = None,
+    deposito_id: Optional[int] = None,
+    desde_id: Optional[int] = None,
+    desde_id_por_par: Optional[dict] = None
+) -> dict:
+    """{(producto_id, deposito_id): suma con signo} de los movimientos archivados con
+    desde < fecha <= hasta (o, si se pasa `desde_id`, con id > desde_id y fecha <= hasta).
+    `desde_id_por_par` ({(producto_id, deposito_id): id}) además deja afuera, para esos pares,
+    los movimientos con id menor o igual al indicado.
+    Si el rango cubre todo el archivo alcanza con la tabla de saldos; si no, se leen los
+    archivos de los meses del rango."""
+    ultimo = archivado_hasta(db)
+    if ultimo is None or (desde is not None and desde >= ultimo):
+        return {}
+    desde_id_por_par = desde_id_por_par or {}
+    if desde is None and desde_id is None and not desde_id_por_par and hasta >= ultimo:
+        saldos = saldos_archivados(db, producto_id=producto_id)
+        return {clave: c for clave, c in saldos.items() if deposito_id is None or clave[1] == deposito_id}
+
+    meses = _meses_con(db, producto_id, deposito_id).filter(StockMovimientoArchivoMes.mes <= _mes(hasta))
+    if desde is not None:
+        meses = meses.filter(StockMovimientoArchivoMes.mes >= _mes(desde))
+    if desde_id is not None:
+        meses = meses.filter(or_(
+            StockMovimientoArchivoMes.hasta_id.is_(None), StockMovimientoArchivoMes.hasta_id > desde_id
+        ))
+    sumas = {}
+    for (mes,) in meses:
+        for datos in _leer_mes(mes):
+            if producto_id is not None and datos["producto_id"] != producto_id:
+                continue
+            if deposito_id is not None and datos["deposito_id"] != deposito_id:
+                continue
+            if desde_id is not None and datos["id"] <= desde_id:
+                continue
+            fecha = datetime.fromisoformat(datos["fecha"])
+            if fecha > hasta or (desde is not None and fecha <= desde):
+                continue
+            clave = (datos["producto_id"], datos["deposito_id"])
+            if clave in desde_id_por_par and datos["id"] <= desde_id_por_par[clave]:
+                continue
+            cantidad = -datos["cantidad"] if datos["tipo"] == MovimientoTipo.egreso.value else datos["cantidad"]
+            sumas[clave] = sumas.get(clave, 0) + cantidad
+    return sumas
+
+def meses_archivados(db: Session) -> set:
+    return {mes for (mes,) in db.query(StockMovimientoArchivoMes.mes)}
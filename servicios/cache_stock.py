@@ -0,0 +1,211 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+from sqlalchemy import event
+from database import SessionLocal
+from models import Stock
+from servicios.eventos_stock import canal_eventos
+
+class CacheTTL:
+    """Cache en memoria de vida corta, invalidada completa ante cualquier escritura de stock"""
+
+    def __init__(self, ttl_segundos: float):
+        self.ttl_segundos = ttl_segundos
+        self._datos = {}
+        self._lock = threading.Lock()
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            vence, valor = entrada
+            if vence < time.monotonic():
+                del self._datos[clave]
+                return None
+            return valor
+
+    def guardar(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl_segundos, valor)
+
+    def invalidar(self):
+        with self._lock:
+            self._datos.clear()
+
+class CacheExistencias:
+    """LRU de filas de stock por (producto_id, deposito_id), actualizada por write-through.
+
+    Un producto queda "completo" cuando se cargaron todas sus filas desde la base; solo
+    entonces GET /stock/{producto_id} puede responder sin consultarla. El TTL acota cuánto
+    puede quedar desactualizado un proceso cuando escribe otro worker."""
+
+    CAMPOS = ("id", "producto_id", "deposito_id", "existencia", "stock_minimo")
+
+    def __init__(self, max_entradas: int = 20000, ttl_segundos: float = 60):
+        self.max_entradas = max_entradas
+        self.ttl_segundos = ttl_segundos
+        self._filas = OrderedDict()  # (producto_id, deposito_id) -> (vence, fila)
+        self._depositos = {}  # producto_id -> set(deposito_id) presentes en _filas
+        self._completos = {}  # producto_id -> vence
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def version(self) -> int:
+        """Se lee antes de consultar la base; si cambió al momento de cargar, el dato puede ser viejo"""
+        return self._version
+
+    def obtener(self, producto_id: int, deposito_id: int) -> Optional[dict]:
+        with self._lock:
+            entrada = self._filas.get((producto_id, deposito_id))
+            if entrada is None:
+                return None
+            vence, fila = entrada
+            if vence < time.monotonic():
+                self._quitar((producto_id, deposito_id))
+                return None
+            self._filas.move_to_end((producto_id, deposito_id))
+            return dict(fila)
+
+    def obtener_producto(self, producto_id: int) -> Optional[list]:
+        with self._lock:
+            vence = self._completos.get(producto_id)
+            if vence is None or vence < time.monotonic():
+                self._completos.pop(producto_id, None)
+                return None
+            claves = [(producto_id, d) for d in sorted(self._depositos.get(producto_id, ()))]
+            for clave in claves:
+                self._filas.move_to_end(clave)
+            return [dict(self._filas[clave][1]) for clave in claves]
+
+    def cargar_producto(self, producto_id: int, filas: list, version: int):
+        """Guarda todas las filas leídas de la base para un producto"""
+        with self._lock:
+            if version != self._version:
+                return
+            vence = time.monotonic() + self.ttl_segundos
+            for fila in filas:
+                self._guardar(fila, vence)
+            self._completos[producto_id] = vence
+            self._desalojar()
+
+    def cargar(self, fila: dict, version: int):
+        """Guarda una fila leída de la base"""
+        with self._lock:
+            if version != self._version:
+                return
+            self._guardar(fila, time.monotonic() + self.ttl_segundos)
+            self._desalojar()
+
+    def registrar(self, fila: dict):
+        """Write-through de una fila modificada y ya confirmada en la base"""
+        with self._lock:
+            self._version += 1
+            clave = (fila.get("producto_id"), fila.get("deposito_id"))
+            if None in clave:
+                # Sin la clave no se sabe qué entrada tocar
+                self._vaciar()
+                return
+            if fila.get("eliminado"):
+                self._quitar(clave)
+                return
+            vence = time.monotonic() + self.ttl_segundos
+            entrada = self._filas.get(clave)
+            if entrada is not None:
+                nueva = dict(entrada[1])
+                nueva.update({k: v for k, v in fila.items() if k in self.CAMPOS and v is not None})
+                self._guardar(nueva, vence)
+            elif all(fila.get(campo) is not None for campo in self.CAMPOS):
+                self._guardar(fila, vence)
+            else:
+                # Fila parcial que no estaba en cache: el producto deja de estar completo
+                self._completos.pop(clave[0], None)
+            self._desalojar()
+
+    def invalidar(self):
+        with self._lock:
+            self._version += 1
+            self._vaciar()
+
+    def _guardar(self, fila: dict, vence: float):
+        clave = (fila["producto_id"], fila["deposito_id"])
+        self._filas[clave] = (vence, {campo: fila[campo] for campo in self.CAMPOS})
+        self._filas.move_to_end(clave)
+        self._depositos.setdefault(clave[0], set()).add(clave[1])
+
+    def _quitar(self, clave):
+        if self._filas.pop(clave, None) is not None:
+            depositos = self._depositos.get(clave[0])
+            if depositos is not None:
+                depositos.discard(clave[1])
+                if not depositos:
+                    del self._depositos[clave[0]]
+
+    def _desalojar(self):
+        while len(self._filas) > self.max_entradas:
+            clave = next(iter(self._filas))
+            self._quitar(clave)
+            # Al perder una de sus filas el producto ya no está completo
+            self._completos.pop(clave[0], None)
+
+    def _vaciar(self):
+        self._filas.clear()
+        self._depositos.clear()
+        self._completos.clear()
+
+# Resúmenes agregados para dashboards (GET /stock/resumen)
+resumen_cache = CacheTTL(ttl_segundos=30)
+
+# Existencia por (producto_id, deposito_id) para consultas de disponibilidad
+existencias_cache = CacheExistencias()
+
+def fila_stock(stock: Stock, eliminado: bool = False) -> dict:
+    """Copia los valores de una fila de stock para usarlos después del commit sin volver a la base"""
+    return {
+        "id": stock.id,
+        "producto_id": stock.producto_id,
+        "deposito_id": stock.deposito_id,
+        "existencia": stock.existencia,
+        "stock_minimo": stock.stock_minimo,
+        "eliminado": eliminado,
+    }
+
+def marcar_stock_modificado(db, filas: Optional[list] = None):
+    """Registra filas de stock modificadas sin pasar por el ORM (bulk o SQL directo).
+    Las caches se actualizan recién cuando la sesión hace commit."""
+    db.info.setdefault("stock_modificado", []).extend(filas or [])
+
+@event.listens_for(SessionLocal, "after_flush")
+def _registrar_stock_orm(session, flush_context):
+    """Los cambios hechos con objetos Stock del ORM se registran solos"""
+    for obj in session.new:
+        if isinstance(obj, Stock):
+            marcar_stock_modificado(session, [fila_stock(obj)])
+    for obj in session.dirty:
+        if isinstance(obj, Stock) and session.is_modified(obj):
+            marcar_stock_modificado(session, [fila_stock(obj)])
+    for obj in session.deleted:
+        if isinstance(obj, Stock):
+            marcar_stock_modificado(session, [fila_stock(obj, eliminado=True)])
+
+@event.listens_for(SessionLocal, "after_commit")
+def _aplicar_cambios_stock(session):
+    # SQLAlchemy también dispara after_commit al liberar un savepoint; solo se publica
+    # cuando confirma la transacción externa
+    if session.in_nested_transaction():
+        return
+    filas = session.info.pop("stock_modificado", None)
+    if filas is None:
+        return
+    resumen_cache.invalidar()
+    for fila in filas:
+        existencias_cache.registrar(fila)
+    canal_eventos.publicar(filas)
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _descartar_cambios_stock(session):
+    # Revertir un savepoint no descarta lo registrado por la transacción externa
+    if session.in_nested_transaction():
+        return
+    session.info.pop("stock_modificado", None)
@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import func, insert, literal, select, tuple_, union_all
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Stock, StockMovimiento, StockMovimientoArchivoSaldo, StockMovimientoCorreccion, MovimientoTipo
+from servicios.operaciones_stock import cantidad_con_signo, bloquear_filas_stock
+
+TOLERANCIA = 1e-6
+MOTIVO_CORRECCION = "Corrección de consistencia stock/movimientos"
+
+def _rangos_productos(db: Session, bloques: int, producto_id: Optional[int] = None) -> list:
+    """Divide el espacio de producto_id (stock y movimientos) en rangos [desde, hasta] contiguos"""
+    if producto_id is not None:
+        return [(producto_id, producto_id)]
+    limites = [
+        db.query(func.min(Stock.producto_id), func.max(Stock.producto_id)).one(),
+        db.query(func.min(StockMovimiento.producto_id), func.max(StockMovimiento.producto_id)).one(),
+    ]
+    minimos = [l[0] for l in limites if l[0] is not None]
+    maximos = [l[1] for l in limites if l[1] is not None]
+    if not minimos:
+        return []
+    inicio, fin = min(minimos), max(maximos)
+    paso = max(1, -(-(fin - inicio + 1) // max(1, bloques)))
+    return [(desde, min(desde + paso - 1, fin)) for desde in range(inicio, fin + 1, paso)]
+
+def _existencia_y_libro(filtro_stock, filtro_movimientos, filtro_archivo):
+    """Una sola consulta (UNION ALL agrupado) con existencia, suma de movimientos y saldo archivado
+    por (producto, depósito): las tres partes salen de la misma foto de la base"""
+    partes = union_all(
+        select(Stock.producto_id, Stock.deposito_id,
+               func.coalesce(Stock.existencia, 0).label("existencia"), literal(0.0).label("movimientos"))
+        .where(filtro_stock),
+        select(StockMovimiento.producto_id, StockMovimiento.deposito_id,
+               literal(0.0), cantidad_con_signo())
+        .where(filtro_movimientos),
+        select(StockMovimientoArchivoSaldo.producto_id, StockMovimientoArchivoSaldo.deposito_id,
+               literal(0.0), StockMovimientoArchivoSaldo.cantidad)
+        .where(filtro_archivo),
+    ).subquery()
+    return select(
+        partes.c.producto_id,
+        partes.c.deposito_id,
+        func.sum(partes.c.existencia).label("existencia"),
+        func.sum(partes.c.movimientos).label("movimientos"),
+    ).group_by(partes.c.producto_id, partes.c.deposito_id).order_by(partes.c.producto_id, partes.c.deposito_id)
+
+def _discrepancia(fila, tolerancia: float) -> Optional[dict]:
+    existencia = fila.existencia or 0
+    movimientos = fila.movimientos or 0
+    if abs(existencia - movimientos) <= tolerancia:
+        return None
+    return {
+        "producto_id": fila.producto_id,
+        "deposito_id": fila.deposito_id,
+        "existencia": existencia,
+        "movimientos": movimientos,
+        "diferencia": existencia - movimientos,
+    }
+
+def _verificar_rango(desde: int, hasta: int, tolerancia: float) -> tuple:
+    """Compara existencia y suma de movimientos (más los saldos ya archivados) para un rango de
+    productos; corre en un hilo del pool con su propia sesión"""
+    db = SessionLocal()
+    try:
+        filas = db.execute(_existencia_y_libro(
+            Stock.producto_id.between(desde, hasta),
+            StockMovimiento.producto_id.between(desde, hasta),
+            StockMovimientoArchivoSaldo.producto_id.between(desde, hasta),
+        )).all()
+    finally:
+        db.close()
+    discrepancias = [d for d in (_discrepancia(fila, tolerancia) for fila in filas) if d]
+    return len(filas), discrepancias
+
+def verificar_consistencia(
+    bloques: int = 16,
+    hilos: int = 4,
+    producto_id: Optional[int] = None,
+    tolerancia: float = TOLERANCIA
+) -> dict:
+    """Recorre todos los (producto, depósito) en bloques paralelos y devuelve las diferencias
+    entre Stock.existencia y la suma con signo de sus movimientos"""
+    db = SessionLocal()
+    try:
+        rangos = _rangos_productos(db, bloques, producto_id)
+    finally:
+        db.close()
+
+    revisadas = 0
+    discrepancias = []
+    with ThreadPoolExecutor(max_workers=max(1, hilos)) as pool:
+        for cantidad, encontradas in pool.map(lambda r: _verificar_rango(*r, tolerancia), rangos):
+            revisadas += cantidad
+            discrepancias.extend(encontradas)
+    return {"revisadas": revisadas, "discrepancias": discrepancias, "corregidas": 0}
+
+def corregir_discrepancias(
+    db: Session,
+    discrepancias: list,
+    motivo: str = MOTIVO_CORRECCION,
+    tolerancia: float = TOLERANCIA
+) -> int:
+    """Registra un ajuste por la diferencia para que los movimientos vuelvan a sumar la existencia.
+    La existencia no se toca: es el valor que ya ven los usuarios. Antes de escribir se bloquean
+    las filas de stock y se vuelve a calcular la diferencia: un movimiento confirmado después del
+    control no tiene que convertirse en un ajuste.
+    Cada ajuste queda marcado en stock_movimientos_correcciones con la existencia del par: el
+    rollup diario no lo cuenta y el histórico parte de ese valor en lugar de sumarlo a un
+    snapshot que ya tenía la diferencia."""
+    pares = {(d["producto_id"], d["deposito_id"]) for d in discrepancias}
+    if not pares:
+        return 0
+    bloquear_filas_stock(db, pares)
+    filas = db.execute(_existencia_y_libro(
+        tuple_(Stock.producto_id, Stock.deposito_id).in_(pares),
+        tuple_(StockMovimiento.producto_id, StockMovimiento.deposito_id).in_(pares),
+        tuple_(StockMovimientoArchivoSaldo.producto_id, StockMovimientoArchivoSaldo.deposito_id).in_(pares),
+    )).all()
+    vigentes = [d for d in (_discrepancia(fila, tolerancia) for fila in filas) if d]
+    if not vigentes:
+        return 0
+
+    fecha = datetime.utcnow()
+    ajustes = [
+        {
+            "producto_id": d["producto_id"],
+            "deposito_id": d["deposito_id"],
+            "cantidad": d["diferencia"],
+            "tipo": MovimientoTipo.ajuste,
+            "motivo": motivo,
+            "fecha": fecha,
+        }
+        for d in vigentes
+    ]
+    # Con RETURNING para marcar cada ajuste; sin pasar por el ORM, así tampoco entra al rollup
+    ids = db.execute(
+        insert(StockMovimiento).returning(StockMovimiento.producto_id, StockMovimiento.deposito_id, StockMovimiento.id),
+        ajustes
+    ).all()
+    existencias = {(d["producto_id"], d["deposito_id"]): d["existencia"] for d in vigentes}
+    db.execute(insert(StockMovimientoCorreccion), [
+        {
+            "movimiento_id": movimiento_id,
+            "producto_id": producto_id,
+            "deposito_id": deposito_id,
+            "fecha": fecha,
+            "existencia": existencias[(producto_id, deposito_id)],
+        }
+        for producto_id, deposito_id, movimiento_id in ids
+    ])
+    return len(ajustes)
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+from typing import Optional
+
+class Suscripcion:
+    """Cola acotada de eventos para un cliente. Si el cliente no consume a tiempo se descartan
+    los eventos pendientes y se le envía un único "resync" para que vuelva a leer el stock."""
+
+    def __init__(self, loop, depositos: Optional[set], productos: Optional[set], max_pendientes: int):
+        self.loop = loop
+        self.depositos = depositos
+        self.productos = productos
+        self.cola = asyncio.Queue(maxsize=max_pendientes)
+
+    def acepta(self, evento: dict) -> bool:
+        return (
+            (self.depositos is None or evento["deposito_id"] in self.depositos)
+            and (self.productos is None or evento["producto_id"] in self.productos)
+        )
+
+    def entregar(self, evento: dict):
+        """Corre en el event loop del cliente"""
+        if self.cola.full():
+            while not self.cola.empty():
+                self.cola.get_nowait()
+            self.cola.put_nowait({"tipo": "resync"})
+            return
+        self.cola.put_nowait(evento)
+
+class CanalEventos:
+    """Publica los cambios de stock confirmados a los clientes suscriptos (SSE / WebSocket)"""
+
+    CAMPOS = ("id", "producto_id", "deposito_id", "existencia", "stock_minimo")
+
+    def __init__(self, max_pendientes: int = 1000):
+        self.max_pendientes = max_pendientes
+        self._suscripciones = set()
+        self._lock = threading.Lock()
+
+    def suscribir(self, depositos: Optional[list] = None, productos: Optional[list] = None) -> Suscripcion:
+        """Se llama desde el endpoint async; los eventos se entregan en su event loop"""
+        suscripcion = Suscripcion(
+            asyncio.get_running_loop(),
+            set(depositos) if depositos else None,
+            set(productos) if productos else None,
+            self.max_pendientes
+        )
+        with self._lock:
+            self._suscripciones.add(suscripcion)
+        return suscripcion
+
+    def desuscribir(self, suscripcion: Suscripcion):
+        with self._lock:
+            self._suscripciones.discard(suscripcion)
+
+    def publicar(self, filas: list):
+        """Se llama después de cada commit con cambios de stock, desde cualquier hilo.
+        Varias escrituras de la misma fila en una transacción salen como un solo evento."""
+        with self._lock:
+            suscripciones = list(self._suscripciones)
+        if not suscripciones:
+            return
+        eventos = {}
+        for fila in filas:
+            clave = (fila.get("producto_id"), fila.get("deposito_id"))
+            if None in clave:
+                # Cambio sin clave conocida: todos los clientes tienen que volver a leer
+                for suscripcion in suscripciones:
+                    self._enviar(suscripcion, {"tipo": "resync"})
+                return
+            evento = eventos.setdefault(clave, {"tipo": "stock"})
+            evento.update({campo: fila[campo] for campo in self.CAMPOS if campo in fila})
+            evento["eliminado"] = fila.get("eliminado", False)
+        for evento in eventos.values():
+            for suscripcion in suscripciones:
+                if suscripcion.acepta(evento):
+                    self._enviar(suscripcion, evento)
+
+    def _enviar(self, suscripcion: Suscripcion, evento: dict):
+        try:
+            suscripcion.loop.call_soon_threadsafe(suscripcion.entregar, evento)
+        except RuntimeError:
+            # El loop del cliente ya se cerró
+            self.desuscribir(suscripcion)
+
+canal_eventos = CanalEventos()
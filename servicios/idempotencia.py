@@ -0,0 +1,97 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import IdempotenciaMovimiento, StockMovimiento
+
+# Tiempo durante el cual un reintento con la misma clave devuelve la respuesta original
+TTL_CLAVES = timedelta(hours=24)
+INTERVALO_PURGA_SEGUNDOS = 600
+
+_ultima_purga = 0.0
+_lock_purga = threading.Lock()
+
+def hash_solicitud(ruta: str, datos) -> str:
+    """Hash de la ruta y el cuerpo, para detectar una clave reutilizada con otra solicitud"""
+    contenido = json.dumps(datos, sort_keys=True, default=str)
+    return hashlib.sha256(f"{ruta}:{contenido}".encode()).hexdigest()
+
+def buscar_respuesta(db: Session, clave: str, hash_actual: str) -> Optional[List[int]]:
+    """Ids de movimientos ya registrados para la clave, o None si no se usó (o venció)"""
+    registro = db.get(IdempotenciaMovimiento, clave)
+    if registro is None:
+        return None
+    if registro.creado < datetime.utcnow() - TTL_CLAVES:
+        db.delete(registro)
+        db.flush()
+        return None
+    if registro.hash_solicitud != hash_actual:
+        raise HTTPException(status_code=422, detail="Idempotency-Key ya utilizada con otra solicitud")
+    return [int(i) for i in registro.movimiento_ids.split(",") if i]
+
+def purgar_vencidas(forzar: bool = False) -> int:
+    """Borra las claves vencidas; se ejecuta como mucho una vez cada INTERVALO_PURGA_SEGUNDOS"""
+    global _ultima_purga
+    with _lock_purga:
+        if not forzar and time.monotonic() - _ultima_purga < INTERVALO_PURGA_SEGUNDOS:
+            return 0
+        _ultima_purga = time.monotonic()
+    db = SessionLocal()
+    try:
+        borradas = db.query(IdempotenciaMovimiento).filter(
+            IdempotenciaMovimiento.creado < datetime.utcnow() - TTL_CLAVES
+        ).delete(synchronize_session=False)
+        db.commit()
+        return borradas
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Error purgando claves de idempotencia: {e}")
+        return 0
+    finally:
+        db.close()
+
+def ejecutar_idempotente(
+    db: Session,
+    clave: Optional[str],
+    ruta: str,
+    datos,
+    operacion: Callable[[Session], List[StockMovimiento]]
+) -> List[int]:
+    """Ejecuta la operación y hace commit, salvo que la clave ya tenga respuesta.
+    La clave se graba en la misma transacción que los movimientos; si otro request con la
+    misma clave gana la carrera, el choque de la clave primaria devuelve su respuesta."""
+    if not clave:
+        movimientos = operacion(db)
+        db.flush()
+        ids = [m.id for m in movimientos]
+        db.commit()
+        return ids
+
+    purgar_vencidas()
+    hash_actual = hash_solicitud(ruta, datos)
+    ids = buscar_respuesta(db, clave, hash_actual)
+    if ids is not None:
+        return ids
+
+    movimientos = operacion(db)
+    db.flush()
+    ids = [m.id for m in movimientos]
+    db.add(IdempotenciaMovimiento(
+        clave=clave,
+        hash_solicitud=hash_actual,
+        movimiento_ids=",".join(str(i) for i in ids)
+    ))
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        ids = buscar_respuesta(db, clave, hash_actual)
+        if ids is None:
+            raise
+    return ids
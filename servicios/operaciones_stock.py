@@ -0,0 +1,90 @@
+from typing import Optional
+from sqlalchemy import func, tuple_, update, case
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+from models import Stock, StockMovimiento, MovimientoTipo
+from servicios.cache_stock import marcar_stock_modificado
+
+COLUMNAS_STOCK = (Stock.id, Stock.producto_id, Stock.deposito_id, Stock.existencia, Stock.stock_minimo)
+
+def cantidad_con_signo():
+    """Efecto de un movimiento sobre la existencia: los egresos restan, ingresos y ajustes suman"""
+    return case(
+        (StockMovimiento.tipo == MovimientoTipo.egreso, -StockMovimiento.cantidad),
+        else_=StockMovimiento.cantidad
+    )
+
+def insert_con_conflicto(db: Session):
+    """insert() del dialecto, que soporta ON CONFLICT (PostgreSQL y SQLite)"""
+    dialecto = db.get_bind().dialect.name
+    if dialecto == "postgresql":
+        return postgresql.insert
+    if dialecto == "sqlite":
+        return sqlite.insert
+    raise NotImplementedError(f"Upsert de stock no soportado para {dialecto}")
+
+def sumar_existencia(db: Session, producto_id: int, deposito_id: int, cantidad: float) -> dict:
+    """Suma cantidad (negativa para restar) a la existencia, creando la fila si no existe.
+    Es una sola sentencia INSERT ... ON CONFLICT DO UPDATE sobre el índice único
+    (producto_id, deposito_id); no hace falta leer la fila antes."""
+    insert = insert_con_conflicto(db)
+    stmt = insert(Stock).values(
+        producto_id=producto_id,
+        deposito_id=deposito_id,
+        existencia=cantidad,
+        stock_minimo=0
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Stock.producto_id, Stock.deposito_id],
+        set_={"existencia": func.coalesce(Stock.existencia, 0) + stmt.excluded.existencia}
+    ).returning(*COLUMNAS_STOCK)
+    fila = dict(db.execute(stmt).one()._mapping)
+    marcar_stock_modificado(db, [fila])
+    return fila
+
+def descontar_existencia(db: Session, producto_id: int, deposito_id: int, cantidad: float) -> Optional[dict]:
+    """Resta cantidad solo si alcanza la existencia, en un único UPDATE condicional.
+    La verificación y la escritura son atómicas en la base, así dos egresos concurrentes
+    no pueden vender de más y tampoco hace falta un SELECT ... FOR UPDATE previo.
+    Devuelve None si no hay fila o el stock es insuficiente."""
+    stmt = update(Stock).where(
+        Stock.producto_id == producto_id,
+        Stock.deposito_id == deposito_id,
+        Stock.existencia >= cantidad
+    ).values(
+        existencia=Stock.existencia - cantidad
+    ).returning(*COLUMNAS_STOCK).execution_options(synchronize_session=False)
+    fila = db.execute(stmt).first()
+    if fila is None:
+        return None
+    fila = dict(fila._mapping)
+    marcar_stock_modificado(db, [fila])
+    return fila
+
+def bloquear_filas_stock(db: Session, pares: set, crear: set = frozenset()) -> dict:
+    """Carga y bloquea (FOR UPDATE, en orden de id) las filas de stock de los pares pedidos.
+    Los pares de `crear` que no existan se insertan antes con ON CONFLICT DO NOTHING,
+    así dos transacciones que crean la misma fila no chocan con el índice único."""
+    if not pares:
+        return {}
+    def cargar(claves):
+        return {
+            (stock.producto_id, stock.deposito_id): stock
+            for stock in db.query(Stock)
+            .filter(tuple_(Stock.producto_id, Stock.deposito_id).in_(claves))
+            .order_by(Stock.id)
+            .with_for_update()
+        }
+    filas = cargar(pares)
+    faltantes = set(crear) - set(filas)
+    if faltantes:
+        insert = insert_con_conflicto(db)
+        db.execute(
+            insert(Stock).on_conflict_do_nothing(index_elements=[Stock.producto_id, Stock.deposito_id]),
+            [
+                {"producto_id": producto_id, "deposito_id": deposito_id, "existencia": 0, "stock_minimo": 0}
+                for producto_id, deposito_id in sorted(faltantes)
+            ]
+        )
+        filas.update(cargar(faltantes))
+    return filas
@@ -0,0 +1,171 @@
+import threading
+from datetime import date, datetime
+from typing import List
+from sqlalchemy import text
+from models import StockMovimiento
+
+TABLA = StockMovimiento.__tablename__
+TABLA_ANTERIOR = f"{TABLA}_sin_particionar"
+PARTICION_DEFAULT = f"{TABLA}_default"
+# Fecha para los movimientos que no tienen (la clave de partición no admite NULL)
+FECHA_SIN_FECHA = datetime(1970, 1, 1)
+
+def _primer_dia(fecha: date) -> date:
+    return date(fecha.year, fecha.month, 1)
+
+def _sumar_meses(fecha: date, meses: int) -> date:
+    total = fecha.year * 12 + fecha.month - 1 + meses
+    return date(total // 12, total % 12 + 1, 1)
+
+def nombre_particion(anio: int, mes: int) -> str:
+    return f"{TABLA}_{anio:04d}_{mes:02d}"
+
+def es_postgresql(engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+def tabla_particionada(conn) -> bool:
+    """True si stock_movimientos ya es una tabla particionada de PostgreSQL"""
+    return bool(conn.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :tabla
+        )
+    """), {"tabla": TABLA}).scalar())
+
+def _crear_particiones(conn, desde: date, hasta: date) -> List[str]:
+    """Crea las particiones mensuales de [desde, hasta] que no existan"""
+    creadas = []
+    mes = _primer_dia(desde)
+    while mes <= hasta:
+        siguiente = _sumar_meses(mes, 1)
+        nombre = nombre_particion(mes.year, mes.month)
+        existe = conn.execute(text("SELECT to_regclass(:nombre) IS NOT NULL"), {"nombre": nombre}).scalar()
+        if not existe:
+            conn.execute(text(
+                f"CREATE TABLE {nombre} PARTITION OF {TABLA} "
+                f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{siguiente.isoformat()}')"
+            ))
+            creadas.append(nombre)
+        mes = siguiente
+    return creadas
+
+def asegurar_particiones(engine, meses_adelante: int = 2) -> List[str]:
+    """Crea por adelantado las particiones del mes actual y los próximos meses.
+    En SQLite, o si la tabla no fue convertida, stock_movimientos es una tabla simple y no hace nada."""
+    if not es_postgresql(engine):
+        return []
+    with engine.begin() as conn:
+        if not tabla_particionada(conn):
+            return []
+        hoy = date.today()
+        creadas = _crear_particiones(conn, hoy, _sumar_meses(_primer_dia(hoy), meses_adelante))
+    for nombre in creadas:
+        print(f"🗂️ Partición creada: {nombre}")
+    return creadas
+
+def desacoplar_particion(engine, anio: int, mes: int, eliminar: bool = False):
+    """Separa un mes de stock_movimientos (queda como tabla suelta) o lo elimina.
+    Solo se permite si el mes ya no tiene movimientos: sacarlos de la tabla sin pasar por
+    archivar_movimientos dejaría sin contar sus cantidades en los saldos archivados."""
+    if not es_postgresql(engine):
+        raise RuntimeError("El particionado de movimientos solo está disponible en PostgreSQL")
+    nombre = nombre_particion(anio, mes)
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE {TABLA} DETACH PARTITION {nombre}"))
+        # Con la partición ya separada (y bloqueada) nadie puede agregarle filas; si queda alguna
+        # se deshace todo el bloque
+        if conn.execute(text(f"SELECT EXISTS (SELECT 1 FROM {nombre})")).scalar():
+            raise RuntimeError(
+                f"La partición {nombre} todavía tiene movimientos: archivalos primero con "
+                f"python archivar_movimientos.py"
+            )
+        if eliminar:
+            conn.execute(text(f"DROP TABLE {nombre}"))
+    print(f"📤 Partición {nombre} {'eliminada' if eliminar else 'desacoplada'}")
+
+def convertir_a_particionada(engine, meses_adelante: int = 2):
+    """Migra stock_movimientos a una tabla particionada por rango mensual de fecha.
+    Copia los datos en una sola transacción; la clave primaria pasa a ser (id, fecha)
+    porque PostgreSQL exige que incluya la columna de partición."""
+    if not es_postgresql(engine):
+        print("ℹ️ SQLite: stock_movimientos se mantiene como tabla simple")
+        return
+    with engine.begin() as conn:
+        if tabla_particionada(conn):
+            print("ℹ️ stock_movimientos ya está particionada")
+            return
+
+        # Los movimientos sin fecha (anteriores al default de la columna) reciben una fecha fija
+        # vieja: siguen siendo los más antiguos, como en la paginación, y caen en la partición default
+        minima = conn.execute(text(f"SELECT min(fecha) FROM {TABLA}")).scalar()
+        sin_fecha = conn.execute(
+            text(f"UPDATE {TABLA} SET fecha = :fecha WHERE fecha IS NULL"), {"fecha": FECHA_SIN_FECHA}
+        ).rowcount
+        secuencia = conn.execute(text("SELECT pg_get_serial_sequence(:tabla, 'id')"), {"tabla": TABLA}).scalar()
+
+        # Liberar los nombres de la tabla, sus índices y la secuencia para la tabla nueva
+        conn.execute(text(f"ALTER TABLE {TABLA} RENAME TO {TABLA_ANTERIOR}"))
+        indices = conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = :tabla"
+        ), {"tabla": TABLA_ANTERIOR}).scalars().all()
+        for indice in indices:
+            conn.execute(text(f'ALTER INDEX "{indice}" RENAME TO "{indice}_sin_particionar"'))
+        if secuencia:
+            conn.execute(text(f"ALTER SEQUENCE {secuencia} OWNED BY NONE"))
+
+        conn.execute(text(
+            f"CREATE TABLE {TABLA} (LIKE {TABLA_ANTERIOR} INCLUDING DEFAULTS) PARTITION BY RANGE (fecha)"
+        ))
+        conn.execute(text(f"ALTER TABLE {TABLA} ALTER COLUMN fecha SET NOT NULL"))
+        conn.execute(text(f"ALTER TABLE {TABLA} ADD PRIMARY KEY (id, fecha)"))
+        conn.execute(text(f"ALTER TABLE {TABLA} ADD FOREIGN KEY (producto_id) REFERENCES productos (id)"))
+        conn.execute(text(f"ALTER TABLE {TABLA} ADD FOREIGN KEY (deposito_id) REFERENCES depositos (id)"))
+        if secuencia:
+            conn.execute(text(f"ALTER SEQUENCE {secuencia} OWNED BY {TABLA}.id"))
+
+        hoy = date.today()
+        creadas = _crear_particiones(
+            conn,
+            minima.date() if minima else hoy,
+            _sumar_meses(_primer_dia(hoy), meses_adelante)
+        )
+        # Red de seguridad para fechas fuera de las particiones creadas
+        conn.execute(text(f"CREATE TABLE {PARTICION_DEFAULT} PARTITION OF {TABLA} DEFAULT"))
+
+        copiadas = conn.execute(text(f"INSERT INTO {TABLA} SELECT * FROM {TABLA_ANTERIOR}")).rowcount
+        conn.execute(text(f"DROP TABLE {TABLA_ANTERIOR}"))
+    print(f"✅ stock_movimientos particionada: {len(creadas)} particiones, {copiadas} movimientos copiados")
+    if sin_fecha:
+        print(f"ℹ️ {sin_fecha} movimientos sin fecha quedaron con fecha {FECHA_SIN_FECHA.date().isoformat()}")
+
+class CreadorParticiones:
+    """Crea una vez por día las particiones de los próximos meses"""
+
+    def __init__(self, engine, intervalo_segundos: int = 24 * 3600, meses_adelante: int = 2):
+        self.engine = engine
+        self.intervalo_segundos = intervalo_segundos
+        self.meses_adelante = meses_adelante
+        self._detener = threading.Event()
+        self.thread = None
+
+    def iniciar(self):
+        if not es_postgresql(self.engine) or self.thread:
+            return
+        self._detener.clear()
+        self.thread = threading.Thread(target=self._bucle, daemon=True)
+        self.thread.start()
+
+    def detener(self):
+        self._detener.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            try:
+                asegurar_particiones(self.engine, self.meses_adelante)
+            except Exception as e:
+                print(f"⚠️ Error creando particiones de movimientos: {e}")
+            self._detener.wait(self.intervalo_segundos)
@@ -0,0 +1,128 @@
+from datetime import date, datetime, time, timedelta
+from typing import Optional
+from sqlalchemy import event, func, case, insert, select
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import StockMovimiento, StockMovimientoCorreccion, StockMovimientoDiario, MovimientoTipo
+from servicios.operaciones_stock import insert_con_conflicto
+from servicios.archivo_movimientos import meses_archivados
+
+TABLA = StockMovimientoDiario.__table__
+COLUMNA_POR_TIPO = {
+    MovimientoTipo.ingreso: "ingresos",
+    MovimientoTipo.egreso: "egresos",
+    MovimientoTipo.ajuste: "ajustes",
+}
+
+def _valor(movimiento, campo):
+    return movimiento[campo] if isinstance(movimiento, dict) else getattr(movimiento, campo)
+
+def acumular_en_rollup(db: Session, movimientos: list):
+    """Suma los movimientos (objetos o dicts) a sus filas diarias con un upsert por lotes.
+    Usa la conexión de la sesión directamente para poder llamarse durante un flush."""
+    totales = {}
+    for mov in movimientos:
+        tipo = MovimientoTipo(getattr(_valor(mov, "tipo"), "value", _valor(mov, "tipo")))
+        fecha = _valor(mov, "fecha") or datetime.utcnow()
+        clave = (_valor(mov, "producto_id"), _valor(mov, "deposito_id"), fecha.date())
+        fila = totales.setdefault(clave, {
+            "producto_id": clave[0], "deposito_id": clave[1], "dia": clave[2],
+            "ingresos": 0, "egresos": 0, "ajustes": 0, "movimientos": 0
+        })
+        fila[COLUMNA_POR_TIPO[tipo]] += _valor(mov, "cantidad")
+        fila["movimientos"] += 1
+    if not totales:
+        return
+
+    stmt = insert_con_conflicto(db)(TABLA)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[TABLA.c.producto_id, TABLA.c.deposito_id, TABLA.c.dia],
+        set_={
+            columna: TABLA.c[columna] + stmt.excluded[columna]
+            for columna in ("ingresos", "egresos", "ajustes", "movimientos")
+        }
+    )
+    db.connection().execute(stmt, list(totales.values()))
+
+@event.listens_for(SessionLocal, "after_flush")
+def _acumular_movimientos_orm(session, flush_context):
+    """Los movimientos agregados con el ORM se acumulan solos; los bulk llaman a acumular_en_rollup"""
+    nuevos = [obj for obj in session.new if isinstance(obj, StockMovimiento)]
+    if nuevos:
+        acumular_en_rollup(session, nuevos)
+
+def _reconstruir_intervalo(db: Session, desde: Optional[date], hasta: Optional[date]) -> int:
+    borrar = db.query(StockMovimientoDiario)
+    if desde:
+        borrar = borrar.filter(StockMovimientoDiario.dia >= desde)
+    if hasta:
+        borrar = borrar.filter(StockMovimientoDiario.dia <= hasta)
+    borrar.delete(synchronize_session=False)
+
+    def total(tipo):
+        return func.coalesce(func.sum(case((StockMovimiento.tipo == tipo, StockMovimiento.cantidad), else_=0)), 0)
+
+    dia = func.date(StockMovimiento.fecha)
+    consulta = select(
+        StockMovimiento.producto_id,
+        StockMovimiento.deposito_id,
+        dia,
+        total(MovimientoTipo.ingreso),
+        total(MovimientoTipo.egreso),
+        total(MovimientoTipo.ajuste),
+        func.count(StockMovimiento.id)
+    ).where(
+        StockMovimiento.fecha.isnot(None),
+        # Los ajustes de la corrección de consistencia no son cambios de stock
+        ~select(StockMovimientoCorreccion.movimiento_id)
+        .where(StockMovimientoCorreccion.movimiento_id == StockMovimiento.id).exists()
+    )
+    if desde:
+        consulta = consulta.where(StockMovimiento.fecha >= datetime.combine(desde, time.min))
+    if hasta:
+        consulta = consulta.where(StockMovimiento.fecha < datetime.combine(hasta + timedelta(days=1), time.min))
+    consulta = consulta.group_by(StockMovimiento.producto_id, StockMovimiento.deposito_id, dia)
+
+    resultado = db.execute(insert(TABLA).from_select(
+        ["producto_id", "deposito_id", "dia", "ingresos", "egresos", "ajustes", "movimientos"],
+        consulta
+    ))
+    return resultado.rowcount
+
+def _intervalos_sin_archivar(desde: date, hasta: date, archivados: set) -> list:
+    """Parte [desde, hasta] en intervalos de días que no caen en meses archivados"""
+    intervalos = []
+    inicio = None
+    mes = date(desde.year, desde.month, 1)
+    while mes <= hasta:
+        siguiente = date(mes.year + mes.month // 12, mes.month % 12 + 1, 1)
+        if f"{mes.year:04d}-{mes.month:02d}" in archivados:
+            if inicio is not None:
+                intervalos.append((inicio, mes - timedelta(days=1)))
+                inicio = None
+            print(f"⚠️ Mes {mes.year:04d}-{mes.month:02d} archivado: se conservan sus totales diarios")
+        elif inicio is None:
+            inicio = max(mes, desde)
+        mes = siguiente
+    if inicio is not None:
+        intervalos.append((inicio, hasta))
+    return intervalos
+
+def reconstruir_rollup(db: Session, desde: Optional[date] = None, hasta: Optional[date] = None) -> int:
+    """Recalcula los totales diarios del rango (o de todo) desde stock_movimientos con un
+    INSERT ... SELECT agrupado. Para backfills o después de corregir movimientos a mano.
+    Los meses archivados se saltean: sus movimientos ya no están en la tabla."""
+    archivados = meses_archivados(db)
+    if not archivados:
+        return _reconstruir_intervalo(db, desde, hasta)
+
+    if desde is None or hasta is None:
+        dias = db.query(func.min(StockMovimientoDiario.dia), func.max(StockMovimientoDiario.dia)).one()
+        fechas = db.query(func.min(StockMovimiento.fecha), func.max(StockMovimiento.fecha)).one()
+        minimos = [d for d in (dias[0], fechas[0] and fechas[0].date()) if d]
+        maximos = [d for d in (dias[1], fechas[1] and fechas[1].date()) if d]
+        if not minimos:
+            return 0
+        desde = desde or min(minimos)
+        hasta = hasta or max(maximos)
+    return sum(_reconstruir_intervalo(db, d, h) for d, h in _intervalos_sin_archivar(desde, hasta, archivados))
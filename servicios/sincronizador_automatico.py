@@ -3,13 +3,12 @@ import threading
 import time
 from datetime import datetime, timedelta
 from typing import Optional
-import requests
-import os
 from dotenv import load_dotenv
 from sqlalchemy.orm import Session
 from database import SessionLocal
 from models import Tecnico, ParteTrabajo, HorasExtras, Feriado
 from routers.horas_extras import calcular_horas_extras
+from servicios.api_partes import paginas_partes
 
 load_dotenv()
 
@@ -17,8 +16,6 @@ class SincronizadorAutomatico:
     """Servicio para sincronizar automáticamente datos desde la API de partes de trabajo"""
     
     def __init__(self):
-        self.api_url = "https://api.partedetrabajo.com/v1/partes/"
-        self.headers = {"X-Auth-Partedetrabajo-Token": os.getenv("API_TOKEN")}
         self.intervalo_segundos = 300  # 5 minutos
         self.activo = False
         self.thread = None
@@ -90,43 +87,14 @@ class SincronizadorAutomatico:
     def _obtener_todos_los_partes(self) -> list:
         """Obtiene todos los partes usando el sistema de bookmark"""
         todos_los_partes = []
-        bookmark = None
-        pagina = 1
         max_paginas = 20  # Límite de seguridad
-        
-        while pagina <= max_paginas:
-            try:
-                # Construir URL con bookmark si existe
-                url = self.api_url
-                if bookmark:
-                    url += f"?bookmark={bookmark}"
-                
-                response = requests.get(url, headers=self.headers, timeout=30)
-                response.raise_for_status()
-                data = response.json()
-                
-                docs = data.get("docs", [])
-                nuevo_bookmark = data.get("bookmark")
-                
-                if not docs:
-                    print(f"📄 Página {pagina}: No hay más documentos")
-                    break
-                
-                print(f"📄 Página {pagina}: {len(docs)} partes obtenidos")
+
+        try:
+            for docs, _ in paginas_partes(max_paginas=max_paginas):
                 todos_los_partes.extend(docs)
-                
-                # Si no hay nuevo bookmark o es igual al anterior, terminamos
-                if not nuevo_bookmark or nuevo_bookmark == bookmark:
-                    print(f"📄 Página {pagina}: No hay más páginas (bookmark)")
-                    break
-                
-                bookmark = nuevo_bookmark
-                pagina += 1
-                
-            except Exception as e:
-                print(f"❌ Error obteniendo página {pagina}: {e}")
-                break
-        
+        except Exception as e:
+            print(f"❌ Error obteniendo partes: {e}")
+
         print(f"📥 Total partes obtenidos: {len(todos_los_partes)}")
         return todos_los_partes
     
@@ -0,0 +1,176 @@
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import and_, func, insert, or_, select, literal, text
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import Stock, StockMovimiento, StockMovimientoArchivoMes, StockMovimientoCorreccion, StockSnapshot
+from servicios.operaciones_stock import cantidad_con_signo
+from servicios.archivo_movimientos import sumar_archivados
+
+def tomar_snapshot(db: Session) -> datetime:
+    """Copia la existencia actual de todo el stock con un solo INSERT ... SELECT, junto con el id
+    del último movimiento que ya está reflejado en esa existencia.
+    En PostgreSQL se toma antes un lock SHARE sobre los movimientos: espera a que terminen las
+    transacciones que ya insertaron alguno y frena las nuevas hasta el commit, así todo movimiento
+    con id <= al guardado está en la foto y todo el que falta va a tener un id mayor, cualquiera
+    sea la fecha con la que se confirme."""
+    if db.get_bind().dialect.name == "postgresql":
+        db.execute(text(f"LOCK TABLE {StockMovimiento.__tablename__} IN SHARE MODE"))
+    # También los archivados: un movimiento archivado antes de la foto ya está en ella
+    ultimo_movimiento = max(
+        db.query(func.max(StockMovimiento.id)).scalar() or 0,
+        db.query(func.max(StockMovimientoArchivoMes.hasta_id)).scalar() or 0
+    )
+    fecha = datetime.utcnow()
+    db.execute(insert(StockSnapshot).from_select(
+        ["fecha", "movimiento_id", "producto_id", "deposito_id", "existencia"],
+        select(
+            literal(fecha, StockSnapshot.fecha.type),
+            literal(ultimo_movimiento, StockSnapshot.movimiento_id.type),
+            Stock.producto_id,
+            Stock.deposito_id,
+            func.coalesce(Stock.existencia, 0)
+        )
+    ))
+    return fecha
+
+def existencia_historica(
+    db: Session,
+    fecha: datetime,
+    producto_id: Optional[int] = None,
+    deposito_id: Optional[int] = None
+) -> dict:
+    """Existencia a una fecha: el snapshot anterior más cercano más los movimientos que no
+    estaban en él (id posterior al del snapshot) con fecha hasta la pedida.
+    Una corrección de consistencia posterior al snapshot reemplaza el valor de su par: guarda la
+    existencia que tenía al corregir y desde ahí se suman solo los movimientos siguientes.
+    Sin snapshot previo se reconstruye desde el primer movimiento."""
+    snapshot = db.query(StockSnapshot.fecha, StockSnapshot.movimiento_id) \
+        .filter(StockSnapshot.fecha <= fecha) \
+        .order_by(StockSnapshot.fecha.desc()).first()
+    fecha_snapshot, movimiento_snapshot = snapshot if snapshot else (None, None)
+
+    existencias = {}
+    if fecha_snapshot is not None:
+        query = db.query(StockSnapshot.producto_id, StockSnapshot.deposito_id, StockSnapshot.existencia) \
+            .filter(StockSnapshot.fecha == fecha_snapshot)
+        if producto_id is not None:
+            query = query.filter(StockSnapshot.producto_id == producto_id)
+        if deposito_id is not None:
+            query = query.filter(StockSnapshot.deposito_id == deposito_id)
+        existencias = {(f.producto_id, f.deposito_id): f.existencia for f in query}
+
+    # Qué movimientos no están en el snapshot
+    if movimiento_snapshot is not None:
+        posteriores = StockMovimiento.id > movimiento_snapshot
+    elif fecha_snapshot is not None:
+        # Snapshot anterior a guardar el id de movimiento: se corta por fecha
+        posteriores = StockMovimiento.fecha > fecha_snapshot
+    else:
+        posteriores = None
+
+    # Última corrección de cada par entre el snapshot y la fecha pedida
+    correcciones = db.query(
+        StockMovimientoCorreccion.producto_id,
+        StockMovimientoCorreccion.deposito_id,
+        func.max(StockMovimientoCorreccion.movimiento_id).label("movimiento_id")
+    ).filter(StockMovimientoCorreccion.fecha <= fecha)
+    if movimiento_snapshot is not None:
+        correcciones = correcciones.filter(StockMovimientoCorreccion.movimiento_id > movimiento_snapshot)
+    elif fecha_snapshot is not None:
+        correcciones = correcciones.filter(StockMovimientoCorreccion.fecha > fecha_snapshot)
+    if producto_id is not None:
+        correcciones = correcciones.filter(StockMovimientoCorreccion.producto_id == producto_id)
+    if deposito_id is not None:
+        correcciones = correcciones.filter(StockMovimientoCorreccion.deposito_id == deposito_id)
+    ultimas = correcciones.group_by(StockMovimientoCorreccion.producto_id, StockMovimientoCorreccion.deposito_id) \
+        .subquery()
+    corregidos = {}
+    for f in db.query(StockMovimientoCorreccion) \
+            .join(ultimas, StockMovimientoCorreccion.movimiento_id == ultimas.c.movimiento_id):
+        existencias[(f.producto_id, f.deposito_id)] = f.existencia
+        corregidos[(f.producto_id, f.deposito_id)] = f.movimiento_id
+
+    deltas = db.query(
+        StockMovimiento.producto_id,
+        StockMovimiento.deposito_id,
+        func.sum(cantidad_con_signo()).label("cantidad")
+    ).outerjoin(ultimas, and_(
+        ultimas.c.producto_id == StockMovimiento.producto_id,
+        ultimas.c.deposito_id == StockMovimiento.deposito_id
+    )).filter(
+        StockMovimiento.fecha <= fecha,
+        or_(
+            StockMovimiento.id > ultimas.c.movimiento_id,
+            ultimas.c.movimiento_id.is_(None) if posteriores is None
+            else and_(ultimas.c.movimiento_id.is_(None), posteriores)
+        )
+    )
+    if producto_id is not None:
+        deltas = deltas.filter(StockMovimiento.producto_id == producto_id)
+    if deposito_id is not None:
+        deltas = deltas.filter(StockMovimiento.deposito_id == deposito_id)
+    for f in deltas.group_by(StockMovimiento.producto_id, StockMovimiento.deposito_id):
+        clave = (f.producto_id, f.deposito_id)
+        existencias[clave] = existencias.get(clave, 0) + (f.cantidad or 0)
+    # Movimientos del mismo intervalo que ya se movieron al archivo
+    if movimiento_snapshot is not None:
+        archivados = sumar_archivados(db, fecha, None, producto_id, deposito_id, desde_id=movimiento_snapshot,
+                                      desde_id_por_par=corregidos)
+    else:
+        archivados = sumar_archivados(db, fecha, fecha_snapshot, producto_id, deposito_id,
+                                      desde_id_por_par=corregidos)
+    for clave, cantidad in archivados.items():
+        existencias[clave] = existencias.get(clave, 0) + cantidad
+
+    return {
+        "fecha": fecha,
+        "snapshot": fecha_snapshot,
+        "items": [
+            {"producto_id": p, "deposito_id": d, "existencia": existencia}
+            for (p, d), existencia in sorted(existencias.items())
+        ]
+    }
+
+class SnapshotsAutomaticos:
+    """Toma un snapshot de stock todas las noches a la hora indicada (hora local del servidor)"""
+
+    def __init__(self, hora: int = 3):
+        self.hora = hora
+        self._detener = threading.Event()
+        self.thread = None
+
+    def iniciar(self):
+        if self.thread:
+            return
+        self._detener.clear()
+        self.thread = threading.Thread(target=self._bucle, daemon=True)
+        self.thread.start()
+        print(f"📸 Snapshots de stock programados todos los días a las {self.hora:02d}:00")
+
+    def detener(self):
+        self._detener.set()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def _segundos_hasta_proxima(self) -> float:
+        ahora = datetime.now()
+        proxima = ahora.replace(hour=self.hora, minute=0, second=0, microsecond=0)
+        if proxima <= ahora:
+            proxima += timedelta(days=1)
+        return (proxima - ahora).total_seconds()
+
+    def _bucle(self):
+        while not self._detener.wait(self._segundos_hasta_proxima()):
+            db = SessionLocal()
+            try:
+                fecha = tomar_snapshot(db)
+                db.commit()
+                print(f"📸 Snapshot de stock tomado: {fecha.isoformat()}")
+            except Exception as e:
+                db.rollback()
+                print(f"❌ Error tomando snapshot de stock: {e}")
+            finally:
+                db.close()
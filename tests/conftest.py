@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+from sqlalchemy import create_engine
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from models import Base, Deposito, Producto, Stock
+from servicios.cache_stock import existencias_cache, resumen_cache
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite propio por test; SessionLocal (y sus listeners) queda apuntando a esta base"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'stock.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    database.SessionLocal.configure(bind=engine)
+    existencias_cache.invalidar()
+    resumen_cache.invalidar()
+    yield engine
+    engine.dispose()
+
+@pytest.fixture
+def db(engine):
+    """Dos depósitos y tres productos (API1..API3) con 10 unidades en cada depósito"""
+    sesion = database.SessionLocal()
+    sesion.add_all([Deposito(id=1, nombre="Central"), Deposito(id=2, nombre="Sucursal")])
+    for i in range(1, 4):
+        sesion.add(Producto(id=i, id_producto=f"API{i}", codigo=f"C{i}", descripcion=f"Producto {i}"))
+    sesion.flush()
+    for i in range(1, 4):
+        for deposito_id in (1, 2):
+            sesion.add(Stock(producto_id=i, deposito_id=deposito_id, existencia=10, stock_minimo=0))
+    sesion.commit()
+    yield sesion
+    sesion.close()
@@ -0,0 +1,87 @@
+from datetime import date, datetime
+
+import pytest
+
+from models import MovimientoTipo, Stock, StockMovimiento, StockMovimientoDiario
+from routers.stock_sync import _registrar_egresos_partes
+from servicios import archivo_movimientos
+from servicios.archivo_movimientos import archivar_movimientos
+from servicios.rollup_movimientos import reconstruir_rollup
+from servicios.snapshots_stock import existencia_historica
+
+@pytest.fixture(autouse=True)
+def directorio_archivo(tmp_path, monkeypatch):
+    monkeypatch.setattr(archivo_movimientos, "DIRECTORIO_ARCHIVO", str(tmp_path / "archivo"))
+
+def _existencia(db, producto_id, deposito_id=1):
+    return db.query(Stock.existencia).filter_by(producto_id=producto_id, deposito_id=deposito_id).scalar()
+
+def test_egreso_archivado_no_se_vuelve_a_registrar(db):
+    db.add(StockMovimiento(producto_id=1, deposito_id=1, cantidad=2, tipo=MovimientoTipo.egreso,
+                           motivo="PARTE1", fecha=datetime(2024, 3, 5)))
+    db.commit()
+    assert archivar_movimientos(db, datetime(2025, 1, 1)) == 1
+
+    parte = {"id": "PARTE1", "lineasProducto": [{"producto_id": "API1", "unidades": 2}]}
+    assert _registrar_egresos_partes(db, [parte]) == 0
+    db.commit()
+    assert _existencia(db, 1) == 10
+    assert db.query(StockMovimiento).count() == 0
+
+def _movimientos_producto_2(db):
+    db.add_all([
+        StockMovimiento(producto_id=2, deposito_id=1, cantidad=10, tipo=MovimientoTipo.ingreso,
+                        motivo="compra", fecha=datetime(2024, 3, 5)),
+        StockMovimiento(producto_id=2, deposito_id=1, cantidad=2, tipo=MovimientoTipo.egreso,
+                        motivo="venta", fecha=datetime(2024, 5, 1)),
+        StockMovimiento(producto_id=2, deposito_id=1, cantidad=1, tipo=MovimientoTipo.egreso,
+                        motivo="venta", fecha=datetime(2024, 7, 1)),
+        StockMovimiento(producto_id=2, deposito_id=1, cantidad=4, tipo=MovimientoTipo.ingreso,
+                        motivo="compra", fecha=datetime(2025, 2, 10)),
+    ])
+    db.commit()
+    archivar_movimientos(db, datetime(2025, 1, 1))
+
+def test_historico_incluye_movimientos_archivados(db):
+    _movimientos_producto_2(db)
+
+    def existencia(fecha):
+        items = existencia_historica(db, fecha, producto_id=2)["items"]
+        return {(i["producto_id"], i["deposito_id"]): i["existencia"] for i in items}.get((2, 1))
+
+    assert existencia(datetime(2024, 6, 1)) == 8
+    assert existencia(datetime(2025, 3, 1)) == 11
+
+def test_reconstruir_rollup_conserva_meses_archivados(db):
+    _movimientos_producto_2(db)
+
+    reconstruir_rollup(db)
+    db.commit()
+
+    dias = dict(db.query(StockMovimientoDiario.dia, StockMovimientoDiario.movimientos).filter_by(producto_id=2))
+    assert dias == {date(2024, 3, 5): 1, date(2024, 5, 1): 1, date(2024, 7, 1): 1, date(2025, 2, 10): 1}
+
+def test_filtro_por_producto_abre_solo_sus_meses(db, monkeypatch):
+    db.add_all([
+        StockMovimiento(producto_id=1, deposito_id=1, cantidad=1, tipo=MovimientoTipo.ingreso,
+                        motivo="compra", fecha=datetime(2024, mes, 1))
+        for mes in (2, 3, 4)
+    ] + [
+        StockMovimiento(producto_id=2, deposito_id=2, cantidad=1, tipo=MovimientoTipo.ingreso,
+                        motivo="compra", fecha=datetime(2024, 3, 15))
+    ])
+    db.commit()
+    archivar_movimientos(db, datetime(2025, 1, 1))
+
+    leidos = []
+    leer_mes = archivo_movimientos._leer_mes
+    monkeypatch.setattr(archivo_movimientos, "_leer_mes", lambda mes: leidos.append(mes) or leer_mes(mes))
+
+    filas = archivo_movimientos.completar_con_archivo(db, [], 10, producto_id=2)
+    assert [(m.producto_id, m.fecha) for m in filas] == [(2, datetime(2024, 3, 15))]
+    assert leidos == ["2024-03"]
+
+    leidos.clear()
+    assert archivo_movimientos.sumar_archivados(db, datetime(2024, 12, 1), datetime(2024, 1, 1),
+                                                deposito_id=2) == {(2, 2): 1}
+    assert leidos == ["2024-03"]
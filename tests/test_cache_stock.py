@@ -0,0 +1,20 @@
+from servicios import cache_stock
+from servicios.operaciones_stock import sumar_existencia
+
+def test_savepoint_no_publica_ni_descarta_antes_del_commit(db, monkeypatch):
+    publicados = []
+    monkeypatch.setattr(cache_stock.canal_eventos, "publicar", publicados.append)
+
+    sumar_existencia(db, 1, 1, 5)
+    with db.begin_nested():
+        sumar_existencia(db, 3, 1, 5)
+    try:
+        with db.begin_nested():
+            raise ValueError("rechazado")
+    except ValueError:
+        pass
+    assert publicados == []
+
+    db.commit()
+    assert [f["producto_id"] for f in publicados[0]] == [1, 3]
+    assert cache_stock.existencias_cache.obtener(1, 1)["existencia"] == 15
@@ -0,0 +1,13 @@
+from sqlalchemy import text
+
+import database
+
+def test_al_arrancar_solo_se_crean_indices_de_tablas_vacias(engine, db, monkeypatch):
+    monkeypatch.setattr(database, "engine", engine)
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX ux_stock_producto_deposito"))  # stock tiene filas
+        conn.execute(text("DROP INDEX ix_stock_movimientos_fecha_id"))  # sin movimientos
+
+    database.crear_indices_faltantes()
+
+    assert database.verificar_indices() == ["ux_stock_producto_deposito"]
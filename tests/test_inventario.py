@@ -0,0 +1,27 @@
+import io
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from models import Stock, StockMovimiento
+from routers.stock_movimientos import toma_inventario
+
+def _csv(texto):
+    return UploadFile(file=io.BytesIO(texto.encode("utf-8")), filename="conteo.csv")
+
+def test_producto_inexistente_es_error_de_linea(db):
+    with pytest.raises(HTTPException) as error:
+        toma_inventario(archivo=_csv("producto_id,cantidad\n1,4\n99,2\n"), deposito_id=1,
+                        simular=False, motivo="Toma de inventario", db=db)
+    assert error.value.status_code == 400
+    assert error.value.detail["errores"] == ["Producto 99 no encontrado"]
+    assert db.query(StockMovimiento).count() == 0
+
+def test_ajusta_solo_los_pares_contados(db):
+    resultado = toma_inventario(archivo=_csv("codigo,deposito_id,cantidad\nC1,1,4\nC2,2,10\n"), deposito_id=None,
+                                simular=False, motivo="Toma de inventario", db=db)
+    assert resultado["ajustes"] == 1
+    assert resultado["sin_diferencia"] == 1
+    existencias = {(s.producto_id, s.deposito_id): s.existencia for s in db.query(Stock)}
+    assert existencias[(1, 1)] == 4
+    assert existencias[(1, 2)] == 10
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from models import MovimientoTipo, StockMovimiento
+from routers.stock_movimientos import get_movimientos
+
+def test_movimientos_sin_fecha_van_al_final(db):
+    db.add_all([
+        StockMovimiento(producto_id=1, deposito_id=1, cantidad=1, tipo=MovimientoTipo.ingreso,
+                        motivo="compra", fecha=datetime(2025, 1, dia))
+        for dia in (1, 2, 3)
+    ])
+    db.commit()
+    db.add_all([
+        StockMovimiento(producto_id=1, deposito_id=1, cantidad=1, tipo=MovimientoTipo.ingreso, motivo="viejo")
+        for _ in range(3)
+    ])
+    db.flush()
+    # Filas anteriores a que fecha tuviera default
+    db.query(StockMovimiento).filter_by(motivo="viejo").update({"fecha": None})
+    db.commit()
+
+    vistos = []
+    cursor = None
+    while True:
+        pagina = get_movimientos(cursor=cursor, limit=2, db=db)
+        vistos += [(m.fecha, m.id) for m in pagina["items"]]
+        cursor = pagina["next_cursor"]
+        if cursor is None:
+            break
+    assert [f for f, _ in vistos] == [datetime(2025, 1, 3), datetime(2025, 1, 2), datetime(2025, 1, 1), None, None, None]
+    assert [i for f, i in vistos if f is None] == [6, 5, 4]
@@ -0,0 +1,38 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import MovimientoTipo, Stock, StockMovimiento
+from servicios import archivo_movimientos
+from servicios.archivo_movimientos import archivar_movimientos
+from servicios.snapshots_stock import existencia_historica, tomar_snapshot
+
+@pytest.fixture(autouse=True)
+def directorio_archivo(tmp_path, monkeypatch):
+    monkeypatch.setattr(archivo_movimientos, "DIRECTORIO_ARCHIVO", str(tmp_path / "archivo"))
+
+def _egreso_confirmado_tarde(db, fecha):
+    """Egreso con fecha anterior al snapshot que se confirma después de tomarlo"""
+    db.add(StockMovimiento(producto_id=1, deposito_id=1, cantidad=4, tipo=MovimientoTipo.egreso,
+                           motivo="venta", fecha=fecha))
+    db.query(Stock).filter_by(producto_id=1, deposito_id=1).update({"existencia": Stock.existencia - 4})
+    db.commit()
+
+def _existencia(db, fecha):
+    items = existencia_historica(db, fecha, producto_id=1, deposito_id=1)["items"]
+    return items[0]["existencia"]
+
+def test_movimiento_confirmado_despues_del_snapshot_no_se_pierde(db):
+    fecha = tomar_snapshot(db)
+    db.commit()
+    _egreso_confirmado_tarde(db, fecha - timedelta(seconds=1))
+
+    assert _existencia(db, datetime.utcnow()) == 6
+
+def test_movimiento_confirmado_tarde_y_archivado(db):
+    fecha = tomar_snapshot(db)
+    db.commit()
+    _egreso_confirmado_tarde(db, fecha - timedelta(seconds=1))
+    assert archivar_movimientos(db, datetime.utcnow()) == 1
+
+    assert _existencia(db, datetime.utcnow()) == 6
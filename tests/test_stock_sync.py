@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from models import MovimientoTipo, Stock, StockMovimiento, SyncOrdenesEstado, SyncOrdenesPendiente
+from routers.stock_sync import _registrar_egresos_partes, sync_ordenes
+from servicios import api_partes
+
+PARTE_SIN_STOCK = {"id": "P1", "estado": "cerrado", "lineasProducto": [{"producto_id": "API1", "unidades": 20}]}
+PARTE_OK = {"id": "P2", "estado": "cerrado", "lineasProducto": [{"producto_id": "API2", "unidades": 1}]}
+
+class _Respuesta:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+@pytest.fixture
+def paginas():
+    return {None: ([PARTE_SIN_STOCK], "b1"), "b1": ([PARTE_OK], "b1")}
+
+@pytest.fixture
+def api(monkeypatch, paginas):
+    """API falsa de dos páginas; registra el bookmark de cada pedido"""
+    pedidos = []
+
+    def get(url, headers=None, params=None, timeout=None):
+        bookmark = (params or {}).get("bookmark")
+        pedidos.append(bookmark)
+        docs, siguiente = paginas[bookmark]
+        return _Respuesta({"docs": docs, "bookmark": siguiente})
+
+    monkeypatch.setattr(api_partes.requests, "get", get)
+    return pedidos
+
+def _egresos(db, motivo):
+    return db.query(StockMovimiento).filter_by(motivo=motivo, tipo=MovimientoTipo.egreso).count()
+
+def test_parte_pendiente_se_reintenta_aunque_no_este_en_la_ultima_pagina(db, api):
+    resultado = sync_ordenes(completa=False, db=db)
+    assert api == [None, "b1"]  # sin corrida completa previa, arranca desde el principio
+    assert resultado["pendientes"] == 1
+    assert _egresos(db, "P2") == 1
+
+    db.query(Stock).filter_by(producto_id=1, deposito_id=1).update({"existencia": 30})
+    db.commit()
+    api.clear()
+    resultado = sync_ordenes(completa=False, db=db)
+    assert api == ["b1"]  # la página de P1 no se vuelve a pedir
+    assert resultado["pendientes"] == 0
+    assert _egresos(db, "P1") == 1
+    assert _egresos(db, "P2") == 1
+    assert db.query(SyncOrdenesPendiente).count() == 0
+
+def test_pendiente_editado_se_procesa_con_la_version_nueva(db, api, paginas):
+    sync_ordenes(completa=False, db=db)
+    paginas[None] = ([dict(PARTE_SIN_STOCK, lineasProducto=[{"producto_id": "API1", "unidades": 2}])], "b1")
+    db.query(Stock).filter_by(producto_id=1, deposito_id=1).update({"existencia": 30})
+    db.commit()
+
+    resultado = sync_ordenes(completa=True, db=db)
+    assert resultado["pendientes"] == 0
+    movimiento = db.query(StockMovimiento).filter_by(motivo="P1").one()
+    assert movimiento.cantidad == 2
+    assert db.query(Stock.existencia).filter_by(producto_id=1, deposito_id=1).scalar() == 28
+
+def test_corrida_completa_periodica(db, api):
+    sync_ordenes(completa=False, db=db)
+    db.get(SyncOrdenesEstado, 1).ultima_completa = datetime.utcnow() - timedelta(days=2)
+    db.commit()
+    api.clear()
+    sync_ordenes(completa=False, db=db)
+    assert api == [None, "b1"]
+    assert db.get(SyncOrdenesEstado, 1).ultima_completa > datetime.utcnow() - timedelta(hours=1)
+
+def _contar_consultas(engine, funcion):
+    sentencias = []
+    escuchar = lambda conn, cursor, sql, params, contexto, varios: sentencias.append(sql)
+    event.listen(engine, "before_cursor_execute", escuchar)
+    try:
+        funcion()
+    finally:
+        event.remove(engine, "before_cursor_execute", escuchar)
+    return len(sentencias)
+
+def test_consultas_no_crecen_con_los_partes(engine, db):
+    def partes(cantidad, prefijo):
+        return [
+            {"id": f"{prefijo}{n}", "lineasProducto": [{"producto_id": f"API{n % 3 + 1}", "unidades": 0.1}]}
+            for n in range(cantidad)
+        ]
+
+    pocos = _contar_consultas(engine, lambda: _registrar_egresos_partes(db, partes(3, "A")))
+    muchos = _contar_consultas(engine, lambda: _registrar_egresos_partes(db, partes(60, "B")))
+    repetidos = _contar_consultas(engine, lambda: _registrar_egresos_partes(db, partes(60, "B")))
+    assert pocos == muchos
+    assert repetidos <= muchos
+    assert _egresos(db, "B0") == 1
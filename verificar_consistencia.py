@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Script para comparar la existencia de stock con la suma de sus movimientos.
+
+    python verificar_consistencia.py                  # solo informa
+    python verificar_consistencia.py --corregir       # registra ajustes por las diferencias
+    python verificar_consistencia.py --hilos 8 --bloques 64
+"""
+
+import argparse
+import time
+from database import SessionLocal
+from servicios.consistencia_stock import verificar_consistencia, corregir_discrepancias
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Verifica la consistencia entre stock y movimientos")
+    parser.add_argument("--corregir", action="store_true", help="Registrar ajustes por las diferencias")
+    parser.add_argument("--hilos", type=int, default=4, help="Bloques revisados en paralelo")
+    parser.add_argument("--bloques", type=int, default=16, help="Cantidad de rangos de producto_id")
+    parser.add_argument("--producto", type=int, help="Revisar un solo producto")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    print("🔍 Verificando consistencia entre stock y movimientos...")
+    resultado = verificar_consistencia(args.bloques, args.hilos, args.producto)
+    for d in resultado["discrepancias"]:
+        print(f"⚠️ Producto {d['producto_id']} / depósito {d['deposito_id']}: "
+              f"existencia {d['existencia']}, movimientos {d['movimientos']} (diferencia {d['diferencia']})")
+    print(f"📊 {resultado['revisadas']} filas revisadas, {len(resultado['discrepancias'])} diferencias "
+          f"en {time.perf_counter() - inicio:.1f}s")
+
+    if args.corregir and resultado["discrepancias"]:
+        db = SessionLocal()
+        try:
+            corregidas = corregir_discrepancias(db, resultado["discrepancias"])
+            db.commit()
+            print(f"✅ {corregidas} ajustes de corrección registrados")
+        except Exception as e:
+            db.rollback()
+            print(f"❌ Error registrando ajustes: {e}")
+            raise
+        finally:
+            db.close()